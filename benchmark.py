@@ -0,0 +1,129 @@
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import resource
+import sys
+import time
+import numpy as np
+from satellite import KDForest, StarlinkManager, criticalRadius
+from test_utils import generateTestUsers, generateTestSatellites
+
+PHASES = ['build', 'query', 'randomInit', 'minConflicts', 'cleanUp', 'refill']
+
+def peakMemoryMB():
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def runScenario(num_users, num_satellites, seed):
+    # time each phase of a seeded scenario; the peak memory is the process's high-water mark over
+    # the whole scenario, as ru_maxrss only ever grows and cannot be split up by phase
+    random.seed(seed)
+    user_coords = np.array(generateTestUsers(int(math.sqrt(num_users)), 1))
+    satellite_coords = np.array(generateTestSatellites(num_satellites, 1.08, 1.09))
+    phases = {}
+
+    def timed(phase, items, func):
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        phases[phase] = {'seconds': seconds, 'throughput': items / seconds if seconds > 0 else None}
+        return value
+
+    kdtree = timed('build', len(user_coords), lambda: KDForest(user_coords))
+    radii = criticalRadius(np.linalg.norm(user_coords[0]), np.linalg.norm(satellite_coords, axis=1))
+    visibility = timed('query', len(satellite_coords), lambda: kdtree.ball_query_csr(satellite_coords, radii))
+    manager = StarlinkManager(user_coords, satellite_coords, visibility=visibility, seed=seed)
+    timed('randomInit', len(satellite_coords), manager.randomInit)
+    timed('minConflicts', len(satellite_coords), manager.minConflicts)
+    timed('cleanUp', len(satellite_coords), manager.cleanUp)
+    timed('refill', len(satellite_coords), manager.refill)
+    return {
+        'users': len(user_coords),
+        'satellites': len(satellite_coords),
+        'seed': seed,
+        'visible_pairs': int(len(visibility[1])),
+        'served_users': len(manager.generateResult()),
+        'peak_memory_mb': peakMemoryMB(),
+        'phases': phases,
+    }
+
+def runIsolated(num_users, num_satellites, seed):
+    # a fresh process per scenario so that peak memory is not carried over
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(runScenario, (num_users, num_satellites, seed))
+
+def benchmark(user_counts, satellite_counts, seed=0, repeat=1, isolate=True):
+    results = []
+    for num_users in user_counts:
+        for num_satellites in satellite_counts:
+            runs = [(runIsolated if isolate else runScenario)(num_users, num_satellites, seed) for _ in range(repeat)]
+            # keep the fastest time of each phase across repeats
+            best = runs[0]
+            for phase in PHASES:
+                best['phases'][phase] = min((run['phases'][phase] for run in runs), key=lambda p: p['seconds'])
+            best['peak_memory_mb'] = max(run['peak_memory_mb'] for run in runs)
+            results.append(best)
+    return results
+
+def compareToBaseline(results, baseline, tolerance, min_seconds=0.0):
+    # phases that are slower than the matching baseline scenario by more than the tolerance,
+    # ignoring slowdowns under min_seconds that are within timer noise
+    baseline = {(entry['users'], entry['satellites']): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        reference = baseline.get((entry['users'], entry['satellites']))
+        if reference is None:
+            continue
+        for phase in PHASES:
+            # phases added since the baseline was recorded have nothing to compare against
+            if phase not in reference['phases']:
+                continue
+            seconds = entry['phases'][phase]['seconds']
+            reference_seconds = reference['phases'][phase]['seconds']
+            if seconds > reference_seconds * (1 + tolerance) and seconds - reference_seconds >= min_seconds:
+                regressions.append({
+                    'users': entry['users'],
+                    'satellites': entry['satellites'],
+                    'phase': phase,
+                    'seconds': seconds,
+                    'baseline_seconds': reference_seconds,
+                })
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the phases of the beam placement pipeline over a grid of scenario sizes.')
+    parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--satellites', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline, as a fraction')
+    parser.add_argument('--min-seconds', type=float, default=0.01, help='ignore slowdowns smaller than this many seconds')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.users, args.satellites, seed=args.seed, repeat=args.repeat)
+    for entry in results:
+        timings = '  '.join(f"{phase} {entry['phases'][phase]['seconds']:.3f}s" for phase in PHASES)
+        print(f"users={entry['users']} satellites={entry['satellites']}  {timings}  peak={entry['peak_memory_mb']:.0f}MB  served={entry['served_users']}")
+    report = {'python': sys.version.split()[0], 'numpy': np.__version__, 'results': results}
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compareToBaseline(results, json.load(f)['results'], args.tolerance, args.min_seconds)
+        report['regressions'] = regressions
+        for regression in regressions:
+            print(f"REGRESSION users={regression['users']} satellites={regression['satellites']} {regression['phase']}: "
+                  f"{regression['seconds']:.3f}s vs {regression['baseline_seconds']:.3f}s")
+        exit_code = 1 if regressions else 0
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return exit_code
+
+if __name__ == '__main__':
+    sys.exit(main())
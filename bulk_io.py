@@ -0,0 +1,104 @@
+import os
+import warnings
+import numpy as np
+
+# rows read or written per chunk
+CHUNK_ROWS = 1 << 20
+ASSIGNMENT_HEADER = 'satellite,user,color\n'
+
+def iterCoordinates(path, chunk_rows=CHUNK_ROWS):
+    # yields (k, 3) float64 arrays of the coordinates in a file, at most chunk_rows at a time:
+    # .npy files and raw little-endian float64 .bin files are memory-mapped and sliced, anything
+    # else is read as text with three numbers per line, separated by commas or whitespace,
+    # skipping '#' comments and a header line
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.npy', '.bin'):
+        coords = _mapCoordinates(path)
+        for start in range(0, len(coords), chunk_rows):
+            yield np.ascontiguousarray(coords[start:start + chunk_rows], dtype=np.float64)
+        return
+    with open(path, 'rb') as f:
+        rest, line = b'', 0
+        # about 40 bytes per text row
+        for block in iter(lambda: f.read(40 * chunk_rows), b''):
+            data = rest + block
+            cut = data.rfind(b'\n') + 1
+            data, rest = data[:cut], data[cut:]
+            if data:
+                yield _parseText(data, path, line, line == 0)
+                line += data.count(b'\n')
+        if rest.strip():
+            yield _parseText(rest, path, line, line == 0)
+
+def loadCoordinates(path, chunk_rows=CHUNK_ROWS):
+    # the whole (n, 3) array, memory-mapped without a copy when the file is float64 binary
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.npy', '.bin'):
+        coords = _mapCoordinates(path)
+        if coords.dtype == np.float64:
+            return coords
+    chunks = list(iterCoordinates(path, chunk_rows))
+    return np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.float64)
+
+def _mapCoordinates(path):
+    if path.lower().endswith('.npy'):
+        coords = np.load(path, mmap_mode='r')
+    else:
+        coords = np.memmap(path, dtype='<f8', mode='r') if os.path.getsize(path) else np.empty(0, dtype=np.float64)
+    if coords.ndim == 1 and len(coords) % 3 == 0:
+        coords = coords.reshape(-1, 3)
+    if coords.ndim != 2 or coords.shape[1] != 3:
+        raise ValueError(f"{path}: expected coordinates of shape (n, 3), got {coords.shape}")
+    return coords
+
+def _parseText(data, path, line, first):
+    if b'#' in data:
+        data = b'\n'.join(row.split(b'#', 1)[0] for row in data.split(b'\n'))
+    data = data.replace(b',', b' ')
+    if first:
+        # a first line that is not numeric is a header
+        head, _, tail = data.lstrip().partition(b'\n')
+        try:
+            [float(token) for token in head.split()]
+        except ValueError:
+            data, line = tail, line + 1
+    # fromstring only warns when it stops at text it cannot parse
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(data.decode(), dtype=np.float64, sep=' ')
+        except (DeprecationWarning, ValueError):
+            values = None
+    if values is None or len(values) % 3 != 0:
+        raise ValueError(f"{path}: expected three numbers per line after line {line}")
+    return values.reshape(-1, 3)
+
+def writeAssignments(path, user_satellite, user_color, chunk_rows=CHUNK_ROWS):
+    # writes one (satellite, user, color) row per served user in chunks of users: an int64
+    # (n, 3) array for .npy, raw little-endian int64 for .bin, CSV otherwise; returns the
+    # number of rows written
+    extension = os.path.splitext(path)[1].lower()
+    served = int(np.count_nonzero(user_satellite >= 0))
+    with open(path, 'wb') as f:
+        if extension == '.npy':
+            np.lib.format.write_array_header_1_0(f, {'descr': '<i8', 'fortran_order': False, 'shape': (served, 3)})
+        elif extension != '.bin':
+            f.write(ASSIGNMENT_HEADER.encode())
+        for start in range(0, len(user_satellite), chunk_rows):
+            satellites = user_satellite[start:start + chunk_rows]
+            users = np.flatnonzero(satellites >= 0)
+            rows = np.stack([satellites[users], users + start, user_color[start:start + chunk_rows][users]], axis=1).astype('<i8')
+            if extension in ('.npy', '.bin'):
+                f.write(rows.tobytes())
+            else:
+                np.savetxt(f, rows, fmt='%d', delimiter=',')
+    return served
+
+def readAssignments(path):
+    # the (n, 3) int64 rows written by writeAssignments
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return np.load(path)
+    if extension == '.bin':
+        return np.fromfile(path, dtype='<i8').reshape(-1, 3)
+    return np.loadtxt(path, dtype=np.int64, delimiter=',', skiprows=1, ndmin=2).reshape(-1, 3)
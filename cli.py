@@ -0,0 +1,46 @@
+import argparse
+import json
+import sys
+import time
+from bulk_io import CHUNK_ROWS, loadCoordinates, writeAssignments
+from satellite import SolverStats, StarlinkManager
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Assign users to satellite beams for coordinates read from files.')
+    parser.add_argument('users', help='user coordinates: .npy, raw float64 .bin, or text with x y z per line')
+    parser.add_argument('satellites', help='satellite coordinates, in the same formats')
+    parser.add_argument('output', help='assignments as satellite,user,color rows: .npy, raw int64 .bin, or CSV')
+    parser.add_argument('--workers', type=int, help='solve independent satellites in this many processes')
+    parser.add_argument('--portfolio', type=int, help='keep the best of this many seeded solves')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--init', choices=['random', 'greedy', 'coarse'], default='random')
+    parser.add_argument('--solver', choices=['minConflicts', 'anneal'], default='minConflicts')
+    parser.add_argument('--time-limit', type=float, help='wall-clock budget of the solver in seconds')
+    parser.add_argument('--index', choices=['auto', 'kdtree', 'cells'], default='auto')
+    parser.add_argument('--cache-dir', help='reuse the index and visibility cached in this directory')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--stats', help='write solver telemetry as JSON to this path')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stats = SolverStats()
+    with stats.phase('load'):
+        user_coords = loadCoordinates(args.users, args.chunk_rows)
+        satellite_coords = loadCoordinates(args.satellites, args.chunk_rows)
+    with stats.phase('index'):
+        if args.cache_dir:
+            manager = StarlinkManager.cached(user_coords, satellite_coords, args.cache_dir, seed=args.seed, index=args.index)
+        else:
+            manager = StarlinkManager(user_coords, satellite_coords, seed=args.seed, index=args.index)
+    manager.run(workers=args.workers, stats=stats, init=args.init, solver=args.solver, time_limit=args.time_limit, portfolio=args.portfolio)
+    with stats.phase('write'):
+        served = writeAssignments(args.output, manager.user_satellite, manager.user_color, args.chunk_rows)
+
+    print(f"served {served} of {len(user_coords)} users with {len(satellite_coords)} satellites in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump(stats.summary(), f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+from contextlib import nullcontext
+
+import numpy as np
+from satellite import StarlinkManager
+
+EARTH_RADIUS_KM = 6371.0
+# km^3/s^2
+EARTH_MU_KM = 398600.4418
+# rad/s, sidereal
+EARTH_ROTATION_RATE = 7.2921159e-5
+
+class CircularOrbits:
+    # circular orbits, one per satellite: radius in the units of the user coordinates, where the
+    # earth's radius is earth_radius, and inclination, right ascension of the ascending node and
+    # phase (the argument of latitude at time 0) in degrees. Positions are in the earth-fixed
+    # frame of the users unless earth_fixed is False, when the earth's rotation is ignored
+    def __init__(self, radius, inclination, raan, phase, earth_radius=1.0, earth_fixed=True):
+        self.radius, self.inclination, self.raan, self.phase = np.broadcast_arrays(
+            *(np.asarray(value, dtype=np.float64).ravel() for value in (radius, inclination, raan, phase)))
+        self.earth_radius = earth_radius
+        self.earth_fixed = earth_fixed
+
+    def __len__(self):
+        return len(self.radius)
+
+    @property
+    def mean_motion(self):
+        # rad/s, from the gravitational parameter rescaled to the coordinate units
+        mu = EARTH_MU_KM * (self.earth_radius / EARTH_RADIUS_KM) ** 3
+        return np.sqrt(mu / self.radius ** 3)
+
+    @property
+    def period(self):
+        return 2 * np.pi / self.mean_motion
+
+    def positions(self, times):
+        # (len(times), len(self), 3) coordinates at the given times in seconds, in one broadcast
+        times = np.asarray(times, dtype=np.float64).reshape(-1, 1)
+        argument = np.radians(self.phase) + self.mean_motion * times
+        node = np.radians(self.raan) - (EARTH_ROTATION_RATE * times if self.earth_fixed else 0.0)
+        cos_u, sin_u = np.cos(argument), np.sin(argument)
+        cos_node, sin_node = np.cos(node), np.sin(node)
+        cos_i, sin_i = np.cos(np.radians(self.inclination)), np.sin(np.radians(self.inclination))
+        return self.radius[:, None] * np.stack([
+            cos_node * cos_u - sin_node * sin_u * cos_i,
+            sin_node * cos_u + cos_node * sin_u * cos_i,
+            np.broadcast_to(sin_u * sin_i, cos_u.shape),
+        ], axis=-1)
+
+class PassPlanner:
+    # assignments for every step of a time window: the satellites are propagated for all steps
+    # at once, visibility for every step is one batched query of the manager's index, and each
+    # step is a warm-started resolve from the assignment of the step before
+    def __init__(self, user_coords, orbits, times, seed=None, index='auto'):
+        self.times = np.asarray(times, dtype=np.float64).ravel()
+        if len(self.times) == 0:
+            raise ValueError("expected at least one time step")
+        self.positions = orbits.positions(self.times)
+        # no satellite sees anyone until the batched query fills in the first step
+        empty = np.zeros(self.positions.shape[1] + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self.manager = StarlinkManager(user_coords, self.positions[0], visibility=empty, seed=seed, index=index)
+        self._visibility = None
+        self.manager.setVisibility(self.stepVisibility(0))
+
+    def __len__(self):
+        return len(self.times)
+
+    def visibility(self):
+        # (indptr, indices) with one row per (step, satellite)
+        if self._visibility is None:
+            self._visibility = self.manager.queryVisibility(self.positions.reshape(-1, 3))
+        return self._visibility
+
+    def stepVisibility(self, step):
+        # the rows of one step, as queryVisibility would give them for its positions
+        indptr, indices = self.visibility()
+        m = self.positions.shape[1]
+        first, last = step * m, (step + 1) * m
+        return indptr[first:last + 1] - indptr[first], indices[indptr[first]:indptr[last]]
+
+    def plan(self, stats=None, init='random', solver='minConflicts', time_limit=None, target_conflicts=0, refill=True):
+        # the result of every step, in order; time_limit bounds each step's solver
+        # from the first step with no beams, also when an earlier plan() left the manager at the last
+        self.manager.updateSatellites(self.positions[0], self.stepVisibility(0))
+        self.manager.restore([(satellite, []) for satellite in self.manager.satellites])
+        results = [self.manager.run(stats=stats, init=init, solver=solver, time_limit=time_limit, target_conflicts=target_conflicts, refill=refill)]
+        for step in range(1, len(self.times)):
+            with nullcontext() if stats is None else stats.phase('updateSatellites'):
+                self.manager.updateSatellites(self.positions[step], self.stepVisibility(step))
+            results.append(self.manager.resolve(stats=stats, init=init, solver=solver, time_limit=time_limit,
+                                                target_conflicts=target_conflicts, refill=refill))
+        return results
@@ -1,10 +1,56 @@
+import hashlib
 import math
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager, nullcontext
 from enum import Enum
-import pdb
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 
 USER_ANGLE_DEGREES = 45
 SATELLITE_ANGLE_DEGREES = 10
+# two beams conflict when the cosine of the angle between them exceeds this
+SATELLITE_ANGLE_COSINE = math.cos(math.radians(SATELLITE_ANGLE_DEGREES))
+# beams per satellite, with ids 1 to MAX_BEAMS
+MAX_BEAMS = 32
+LEAF_SIZE = 128
+CELL_DEGREES = 1.0
+# cells of the coarse problem, a few degrees wide as seen from low orbit
+COARSE_CELL_DEGREES = 0.25
+# bump when the layout of the cached index files changes
+CACHE_VERSION = 1
+
+def criticalRadius(r, d):
+    # critical radius to query k-d tree for users at radius r and satellites at
+    # distance d from the center, worked out using geometry
+    return np.sqrt(2) * d * np.sin(np.pi / 4 - np.arcsin(1 / np.sqrt(2) * r / d))
+
+def visibilityAngle(r, d):
+    # largest angle at the center of the Earth between a user at radius r and a
+    # satellite at distance d that still puts the satellite within USER_ANGLE_DEGREES
+    # of the user's zenith, from the law of sines; negative when nothing is visible
+    zenith = np.radians(USER_ANGLE_DEGREES)
+    return zenith - np.arcsin(np.clip(np.sin(zenith) * r / d, -1.0, 1.0))
+
+def cacheKey(user_coords, satellite_coords, index):
+    # hash of everything the cached visibility and user index depend on
+    digest = hashlib.sha256()
+    digest.update(repr((CACHE_VERSION, index, USER_ANGLE_DEGREES, SATELLITE_ANGLE_DEGREES, LEAF_SIZE, CELL_DEGREES)).encode())
+    for coords in (user_coords, satellite_coords):
+        coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 3)
+        digest.update(repr(coords.shape).encode())
+        digest.update(coords.data)
+    return digest.hexdigest()
+
+def withinUserCone(user_points, satellite_points):
+    # whether each satellite is within USER_ANGLE_DEGREES of its user's zenith
+    vectors = satellite_points - user_points
+    cosines = np.einsum('ij,ij->i', user_points, vectors)
+    return cosines >= math.cos(math.radians(USER_ANGLE_DEGREES)) * np.linalg.norm(user_points, axis=1) * np.linalg.norm(vectors, axis=1)
 
 class Colors(Enum):
     Blue = 0
@@ -12,106 +58,208 @@ class Colors(Enum):
     Red = 2
     Yellow = 3
 
+# bitmask with every color blocked
+ALL_COLORS = (1 << len(Colors)) - 1
+
 class Satellite:
-    def __init__(self, id, x, y, z, visible_users):
+    __slots__ = (
+        'id', 'x', 'y', 'z', 'visible_users', 'users', '_connections', '_directions', '_beam_directions',
+        '_color_buckets', '_conflict_counts', '_conflicted', '_conflicted_index',
+    )
+
+    def __init__(self, id, x, y, z, visible_users, users=None):
         self.id = id
         self.x = x
         self.y = y
         self.z = z
-        self.visible_users = visible_users
+        # sorted array of user ids, normally a row of the manager's visibility matrix
+        self.visible_users = np.asarray(visible_users if visible_users is not None else [], dtype=np.int64)
+        # user table indexed by user id
+        self.users = users
+        self.resetDirections()
         self.current_connections = set()
 
+    def resetDirections(self):
+        # unit vector per user id, and array of unit vectors aligned with visible_users
+        self._directions = {}
+        self._beam_directions = None
+
     def addUsersCanConnect(self, users):
-        self.visible_users = users
+        self.visible_users = np.asarray(users, dtype=np.int64)
+        self.resetDirections()
 
     def addUser(self, user):
-        self.visible_users.add(user)
+        self.visible_users = np.union1d(self.visible_users, [user.id])
+        self.resetDirections()
+
+    def userDirection(self, user):
+        direction = self._directions.get(user.id)
+        if direction is None:
+            vector = (user.x - self.x, user.y - self.y, user.z - self.z)
+            magnitude = math.sqrt(vector[0] * vector[0] + vector[1] * vector[1] + vector[2] * vector[2]) or 1.0
+            direction = self._directions[user.id] = (vector[0] / magnitude, vector[1] / magnitude, vector[2] / magnitude)
+        return direction
+
+    def beamDirections(self):
+        if self._beam_directions is None:
+            coords = getattr(self.users, 'coords', None)
+            if coords is not None:
+                coords = coords[self.visible_users]
+            else:
+                coords = np.array([self.users[i].get_coordinates() for i in self.visible_users.tolist()], dtype=np.float64).reshape(-1, 3)
+            vectors = coords - (self.x, self.y, self.z)
+            magnitudes = np.linalg.norm(vectors, axis=1, keepdims=True)
+            self._beam_directions = vectors / np.where(magnitudes > 0, magnitudes, 1.0)
+        return self._beam_directions
+
+    @property
+    def current_connections(self):
+        return self._connections.keys()
+
+    @current_connections.setter
+    def current_connections(self, connections):
+        # per-color connection buckets, conflict count per connection, and the
+        # conflicted connections as a list plus positions for O(1) sampling; dicts
+        # rather than sets keep iteration in insertion order, so seeded runs repeat
+        self._connections = {}
+        self._color_buckets = {color: {} for color in Colors}
+        self._conflict_counts = {}
+        self._conflicted = []
+        self._conflicted_index = {}
+        for connection in connections:
+            self.addConnection(connection)
+
+    def _conflictsInBucket(self, connection):
+        direction = self.userDirection(connection.user)
+        for other in self._color_buckets[connection.color]:
+            if other is not connection:
+                d = self.userDirection(other.user)
+                if direction[0] * d[0] + direction[1] * d[1] + direction[2] * d[2] > SATELLITE_ANGLE_COSINE:
+                    yield other
+
+    def _changeConflictCount(self, connection, delta):
+        count = self._conflict_counts[connection] + delta
+        self._conflict_counts[connection] = count
+        if count > 0 and connection not in self._conflicted_index:
+            self._conflicted_index[connection] = len(self._conflicted)
+            self._conflicted.append(connection)
+        elif count == 0 and connection in self._conflicted_index:
+            # swap the last conflicted connection into the freed position
+            position = self._conflicted_index.pop(connection)
+            last = self._conflicted.pop()
+            if last is not connection:
+                self._conflicted[position] = last
+                self._conflicted_index[last] = position
 
     def addConnection(self, connection):
-        self.current_connections.add(connection)
+        self._connections[connection] = None
+        self._conflict_counts[connection] = 0
+        for other in list(self._conflictsInBucket(connection)):
+            self._changeConflictCount(other, 1)
+            self._changeConflictCount(connection, 1)
+        self._color_buckets[connection.color][connection] = None
 
     def removeConnection(self, connection):
-        self.current_connections.remove(connection)
+        del self._connections[connection]
+        del self._color_buckets[connection.color][connection]
+        for other in list(self._conflictsInBucket(connection)):
+            self._changeConflictCount(other, -1)
+            self._changeConflictCount(connection, -1)
+        del self._conflict_counts[connection]
+
+    def numConflictedConnections(self):
+        return len(self._conflicted)
 
     def removeConflictingConnections(self):
-        connections_to_remove = set()
-        for conn1 in self.current_connections:
-            for conn2 in self.current_connections:
-                if self.areConflictingConnections(conn1, conn2):
-                        connections_to_remove.add(conn1)
-                        connections_to_remove.add(conn2)
+        connections_to_remove = set(self._conflicted)
         for conn in connections_to_remove:
             conn.user.current_connection = None
-            self.current_connections.remove(conn)
+            self.removeConnection(conn)
+        return connections_to_remove
 
-    def findRandomConflictedConnection(self):
+    def findRandomConflictedConnection(self, rng=random):
+        if not self._conflicted:
+            return None
+        conn1 = rng.choice(self._conflicted)
+        return conn1, next(self._conflictsInBucket(conn1))
+
+    def blockedColors(self, directions):
+        # bitmask per beam direction of the colors a connection within SATELLITE_ANGLE_DEGREES uses
         connections = list(self.current_connections)
-        random.shuffle(connections)
-        for conn1 in connections:
-            for conn2 in connections:
-                if self.areConflictingConnections(conn1, conn2):
-                        return conn1, conn2
-        return None
-
-    def getAlternativeMinConflictConnection(self, conflict_connection, unassigned_users):
-        candidates = []
-        candidate_users = {conflict_connection.user}.union(self.visible_users.intersection(unassigned_users)) # union of current user and all unassigned users
-        for user in candidate_users:
-            for color in Colors:
-                # create an alternate connection for this user and color
-                alt_connection = SatelliteConnection(
-                    sat_id=self.id,
-                    conn_id=conflict_connection.conn_id,
-                    user=user,
-                    color=color
-                )
-                # count the number of conflicting connections
-                num_conflicts = self.getNumConflictingConnections(alt_connection)
-                candidates.append((alt_connection, num_conflicts))
-
-        # choose the alternate connection with the lowest score
-        candidates.sort(key=lambda x: x[1])
-        min_score = candidates[0][1]
-        best_candidates = [c for c in candidates if c[1] == min_score]
-
-        return random.choice(best_candidates)[0]
+        if not connections or len(directions) == 0:
+            return np.zeros(len(directions), dtype=np.uint8)
+        near = directions @ np.array([self.userDirection(conn.user) for conn in connections]).T > SATELLITE_ANGLE_COSINE
+        bits = np.array([1 << conn.color.value for conn in connections], dtype=np.uint8)
+        return np.bitwise_or.reduce(near * bits, axis=1).astype(np.uint8)
 
-    def getNumConflictingConnections(self, connection):
-        # similar to removeConflictingConnections(), but counts instead of removing
-        num_conflicts = 0
+    def freeBeams(self):
+        # sorted ids of the beams not in use, all MAX_BEAMS on a fresh satellite
+        return sorted(set(range(1, MAX_BEAMS + 1)) - {conn.conn_id for conn in self.current_connections})
+
+    def colorUse(self):
+        # number of connections per color value
+        color_use = [0] * len(Colors)
         for conn in self.current_connections:
-            if self.areConflictingConnections(conn, connection):
-                num_conflicts += 1
-        return num_conflicts
+            color_use[conn.color.value] += 1
+        return color_use
+
+    def unassignedVisibleUsers(self, user_satellite):
+        # visible user ids that no satellite currently serves
+        return self.visible_users[user_satellite[self.visible_users] < 0]
+
+    def getAlternativeMinConflictConnection(self, conflict_connection, user_satellite, rng=random):
+        # candidates are the current user and all unassigned visible users, each with every color
+        conflict_user = conflict_connection.user
+        free = (user_satellite[self.visible_users] < 0) & (self.visible_users != conflict_user.id)
+        candidate_users = np.concatenate([[conflict_user.id], self.visible_users[free]])
+        candidate_directions = np.vstack([self.userDirection(conflict_user), self.beamDirections()[free]])
+
+        # candidates x connections cosine matrix, then conflicts per (candidate, color)
+        connections = list(self.current_connections)
+        conflicts = np.zeros((len(candidate_users), len(Colors)), dtype=np.int64)
+        if connections:
+            directions = np.array([self.userDirection(conn.user) for conn in connections])
+            colors = np.zeros((len(connections), len(Colors)), dtype=np.int64)
+            colors[np.arange(len(connections)), [conn.color.value for conn in connections]] = 1
+            conflicts = (candidate_directions @ directions.T > SATELLITE_ANGLE_COSINE).astype(np.int64) @ colors
+
+        # random choice among the candidates with the fewest conflicts, only it becomes a connection
+        best_users, best_colors = np.nonzero(conflicts == conflicts.min())
+        choice = rng.randrange(len(best_users))
+        user_id = int(candidate_users[best_users[choice]])
+        user = conflict_user if user_id == conflict_user.id else self.users[user_id]
+        return SatelliteConnection(sat_id=self.id, conn_id=conflict_connection.conn_id, user=user, color=Colors(int(best_colors[choice])))
+
+    def getNumConflictingConnections(self, connection):
+        if connection in self._conflict_counts:
+            return self._conflict_counts[connection]
+        return sum(1 for _ in self._conflictsInBucket(connection))
 
     def areConflictingConnections(self, conn1, conn2):
-        if conn1 == conn2:
-                return False
-        if conn1.color == conn2.color:
-            angle = self.angleBetweenConnections(conn1, conn2)
-            if angle < 10:
-                return True
+        if conn1 is conn2 or conn1.color != conn2.color:
             return False
-    
+        d1 = self.userDirection(conn1.user)
+        d2 = self.userDirection(conn2.user)
+        return d1[0] * d2[0] + d1[1] * d2[1] + d1[2] * d2[2] > SATELLITE_ANGLE_COSINE
+
     def angleBetweenConnections(self, connection1, connection2):
-        point1 = connection1.user.get_coordinates()
-        point2 = connection2.user.get_coordinates()
-        vector1 = [point1[0] - self.x, point1[1] - self.y, point1[2] - self.z]
-        vector2 = [point2[0] - self.x, point2[1] - self.y, point2[2] - self.z]
-        dot_product = sum([a * b for a, b in zip(vector1, vector2)])
-        magnitude1 = math.sqrt(sum([a * a for a in vector1]))
-        magnitude2 = math.sqrt(sum([a * a for a in vector2]))
-        cosine_angle = round(dot_product / (magnitude1 * magnitude2), 3)
-        return math.degrees(math.acos(cosine_angle))
+        d1 = self.userDirection(connection1.user)
+        d2 = self.userDirection(connection2.user)
+        cosine_angle = d1[0] * d2[0] + d1[1] * d2[1] + d1[2] * d2[2]
+        return math.degrees(math.acos(max(-1.0, min(1.0, cosine_angle))))
 
 class SatelliteConnection:
+    __slots__ = ('sat_id', 'conn_id', 'user', 'color')
+
     def __init__(self, sat_id, conn_id, user, color):
         self.sat_id = sat_id # sat ID number
-        self.conn_id = conn_id # 1-32
+        self.conn_id = conn_id # 1-MAX_BEAMS
         self.user = user # user object
         self.color = color # color enum
 
 class User:
+    __slots__ = ('id', 'x', 'y', 'z', 'current_connection')
+
     def __init__(self, id, x, y, z):
         self.id = id
         self.x = x
@@ -122,103 +270,1021 @@ class User:
     def get_coordinates(self):
         return (self.x, self.y, self.z)
 
-class KDNode:
-    def __init__(self, point=None, axis=None, left=None, right=None):
-        self.point = point
-        self.axis = axis
-        self.left = left
-        self.right = right
+class UserTable:
+    # User objects are only materialized when first accessed, as views over
+    # the manager's user coordinate array
+    def __init__(self, coords):
+        self.coords = coords
+        self._users = [None] * len(coords)
+
+    def __len__(self):
+        return len(self._users)
+
+    def __getitem__(self, i):
+        user = self._users[i]
+        if user is None:
+            user = self._users[i] = User(int(i), *self.coords[i].tolist())
+        return user
+
+    def __iter__(self):
+        for i in range(len(self._users)):
+            yield self[i]
+
+    def extend(self, coords):
+        # coords is the grown coordinate array, with the new users at the end
+        self._users.extend([None] * (len(coords) - len(self._users)))
+        self.coords = coords
 
 class KDTree:
-    def __init__(self, points=None):
+    # array-backed k-d tree: nodes live in flat arrays and every node owns a
+    # contiguous range of self.indices, so a subtree is a single slice
+    ARRAYS = ('indices', 'start', 'end', 'axis', 'split', 'left', 'right', 'lo', 'hi')
+
+    def __init__(self, points=None, leaf_size=LEAF_SIZE):
+        self.leaf_size = leaf_size
+        self.points = np.empty((0, 3))
+        self.indices = np.empty(0, dtype=np.int64)
         self.root = None
         if points is not None:
             self.build(points)
 
+    @classmethod
+    def fromArrays(cls, points, arrays, leaf_size=LEAF_SIZE):
+        # a tree over points from the node arrays of an earlier build, without rebuilding
+        tree = cls(leaf_size=leaf_size)
+        tree.points = points
+        for name in cls.ARRAYS:
+            setattr(tree, name, arrays[name])
+        tree.root = 0 if len(points) > 0 else None
+        return tree
+
     def build(self, points):
-        self.root = self._build(points)
+        self.points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+        n = len(self.points)
+        self.indices = np.arange(n, dtype=np.int64)
+        self.root = 0 if n > 0 else None
+        start, end, axis, split, left, right = [0], [n], [-1], [0.0], [-1], [-1]
+        stack = [(0, 0)] if n > 0 else []
+        while stack:
+            node, depth = stack.pop()
+            s, e = start[node], end[node]
+            if e - s <= self.leaf_size:
+                continue
+            # split at the median, found with an O(n) partition instead of a full sort
+            ax = depth % 3
+            mid = (s + e) // 2
+            members = self.indices[s:e]
+            self.indices[s:e] = members[np.argpartition(self.points[members, ax], mid - s)]
+            axis[node] = ax
+            split[node] = self.points[self.indices[mid], ax]
+            for child_start, child_end in ((s, mid), (mid, e)):
+                start.append(child_start)
+                end.append(child_end)
+                axis.append(-1)
+                split.append(0.0)
+                left.append(-1)
+                right.append(-1)
+                stack.append((len(start) - 1, depth + 1))
+            left[node], right[node] = len(start) - 2, len(start) - 1
 
-    def _build(self, points, depth=0):
-        if len(points) == 0:
-            return None
-        axis = depth % 3
-        sorted_points = sorted(points, key=lambda x: x[axis])
-        mid = len(points) // 2
-        return KDNode(
-            point=sorted_points[mid],
-            axis=axis,
-            left=self._build(sorted_points[:mid], depth + 1),
-            right=self._build(sorted_points[mid+1:], depth + 1)
-        )
+        if n == 0:
+            start, end, axis, split, left, right = [], [], [], [], [], []
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+        self.axis = np.array(axis, dtype=np.int64)
+        self.split = np.array(split, dtype=np.float64)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self._buildBoundingBoxes()
+
+    def _buildBoundingBoxes(self):
+        # leaf boxes in one reduceat over the partitioned points, then
+        # internal boxes bottom-up (children are always created after parents)
+        self.lo = np.empty((len(self.start), 3))
+        self.hi = np.empty((len(self.start), 3))
+        if len(self.start) == 0:
+            return
+        leaves = np.nonzero(self.left < 0)[0]
+        leaves = leaves[np.argsort(self.start[leaves])]
+        ordered = self.points[self.indices]
+        self.lo[leaves] = np.minimum.reduceat(ordered, self.start[leaves], axis=0)
+        self.hi[leaves] = np.maximum.reduceat(ordered, self.start[leaves], axis=0)
+        lo, hi = self.lo.tolist(), self.hi.tolist()
+        left, right = self.left.tolist(), self.right.tolist()
+        for node in np.nonzero(self.left >= 0)[0][::-1].tolist():
+            l, r = left[node], right[node]
+            lo[node] = [min(a, b) for a, b in zip(lo[l], lo[r])]
+            hi[node] = [max(a, b) for a, b in zip(hi[l], hi[r])]
+        self.lo = np.array(lo)
+        self.hi = np.array(hi)
 
     def ball_query(self, center, r):
-        result = set()
-        self._ball_query(self.root, center, r, result)
-        return result
+        return set(map(tuple, self.points[self.ball_query_indices(center, r)].tolist()))
+
+    def ball_query_indices(self, center, r):
+        return self.ball_query_batch([center], [r])[0]
+
+    def ball_query_batch(self, centers, radii):
+        # returns one sorted array of point indices per center
+        indptr, indices = self.ball_query_csr(centers, radii)
+        return np.split(indices, indptr[1:-1])
+
+    def ball_query_csr(self, centers, radii):
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(centers),))
+        r2 = radii * radii
+        hit_queries, hit_points = [], []
+        stack = [] if self.root is None or len(centers) == 0 else [(self.root, np.arange(len(centers)))]
+        while stack:
+            node, queries = stack.pop()
+            c = centers[queries]
+            # drop queries whose ball misses this node's bounding box
+            gap = np.maximum(np.maximum(self.lo[node] - c, c - self.hi[node]), 0)
+            keep = np.einsum('ij,ij->i', gap, gap) <= r2[queries]
+            queries, c = queries[keep], c[keep]
+            if len(queries) == 0:
+                continue
+            members = self.indices[self.start[node]:self.end[node]]
+            # queries whose ball contains the whole box take the subtree as is
+            far = np.maximum(np.abs(c - self.lo[node]), np.abs(c - self.hi[node]))
+            covers = np.einsum('ij,ij->i', far, far) <= r2[queries]
+            if covers.any():
+                covering = queries[covers]
+                hit_queries.append(np.repeat(covering, len(members)))
+                hit_points.append(np.tile(members, len(covering)))
+                queries, c = queries[~covers], c[~covers]
+                if len(queries) == 0:
+                    continue
+            if self.left[node] < 0:
+                diff = c[:, None, :] - self.points[members][None, :, :]
+                inside = np.einsum('ijk,ijk->ij', diff, diff) <= r2[queries][:, None]
+                qi, pi = np.nonzero(inside)
+                hit_queries.append(queries[qi])
+                hit_points.append(members[pi])
+            else:
+                stack.append((self.right[node], queries))
+                stack.append((self.left[node], queries))
+
+        if not hit_queries:
+            return np.zeros(len(centers) + 1, dtype=np.int64), np.empty(0, dtype=np.int64)
+        hit_queries = np.concatenate(hit_queries)
+        hit_points = np.concatenate(hit_points)
+        order = np.lexsort((hit_points, hit_queries))
+        indptr = np.zeros(len(centers) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(hit_queries, minlength=len(centers)), out=indptr[1:])
+        return indptr, hit_points[order]
+
+class KDForest:
+    # dynamic point set for inserts and deletes: a logarithmic-method forest of
+    # static KDTrees with strictly decreasing sizes, plus tombstones for deleted points
+    def __init__(self, points=None, leaf_size=LEAF_SIZE):
+        self.leaf_size = leaf_size
+        self.trees = []  # (KDTree, sorted global ids of its points)
+        self._deleted = np.zeros(0, dtype=bool)
+        self.num_points = 0
+        self.num_deleted = 0
+        # deleted points still stored in some tree
+        self.num_tombstones = 0
+        if points is not None:
+            self.insert(points)
+
+    @classmethod
+    def fromTree(cls, tree):
+        # a forest holding one prebuilt tree whose points have ids 0..n-1
+        forest = cls(leaf_size=tree.leaf_size)
+        n = len(tree.points)
+        if n:
+            forest.trees.append((tree, np.arange(n, dtype=np.int64)))
+        forest._deleted = np.zeros(n, dtype=bool)
+        forest.num_points = n
+        return forest
+
+    def __len__(self):
+        return self.num_points - self.num_deleted
+
+    @property
+    def deleted(self):
+        return self._deleted[:self.num_points]
+
+    def insert(self, points):
+        # returns the ids given to the new points, which continue from the last insert
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+        ids = np.arange(self.num_points, self.num_points + len(points), dtype=np.int64)
+        if self.num_points + len(points) > len(self._deleted):
+            deleted = np.zeros(2 * (self.num_points + len(points)), dtype=bool)
+            deleted[:self.num_points] = self.deleted
+            self._deleted = deleted
+        self.num_points += len(points)
+        new_ids = ids
+        # merge every tree no larger than the new one, like carrying in a binary counter
+        while self.trees and len(self.trees[-1][1]) <= len(ids):
+            tree, tree_ids = self.trees.pop()
+            alive = ~self._deleted[tree_ids]
+            self.num_tombstones -= len(tree_ids) - int(alive.sum())
+            points = np.concatenate([tree.points[alive], points])
+            ids = np.concatenate([tree_ids[alive], ids])
+        if len(ids):
+            self.trees.append((KDTree(points, self.leaf_size), ids))
+        return new_ids
+
+    def delete(self, ids):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ids = ids[~self._deleted[ids]]
+        self._deleted[ids] = True
+        self.num_deleted += len(ids)
+        self.num_tombstones += len(ids)
+        # rebuild once tombstones outnumber the live points
+        if self.num_tombstones > len(self):
+            self.rebuild()
+
+    def rebuild(self):
+        points = [tree.points[~self._deleted[ids]] for tree, ids in self.trees]
+        ids = [ids[~self._deleted[ids]] for _, ids in self.trees]
+        self.trees = []
+        self.num_tombstones = 0
+        if sum(len(i) for i in ids):
+            self.trees.append((KDTree(np.concatenate(points), self.leaf_size), np.concatenate(ids)))
+
+    def ball_query_indices(self, center, r):
+        return self.ball_query_batch([center], [r])[0]
+
+    def ball_query_batch(self, centers, radii):
+        indptr, indices = self.ball_query_csr(centers, radii)
+        return np.split(indices, indptr[1:-1])
 
-    def _ball_query(self, node, center, r, indices):
-        if node is None:
+    def ball_query_csr(self, centers, radii):
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        hit_queries, hit_points = [], []
+        for tree, tree_ids in self.trees:
+            indptr, indices = tree.ball_query_csr(centers, radii)
+            queries = np.repeat(np.arange(len(centers)), np.diff(indptr))
+            ids = tree_ids[indices]
+            alive = ~self._deleted[ids]
+            hit_queries.append(queries[alive])
+            hit_points.append(ids[alive])
+        if len(hit_queries) == 1:
+            # a single tree already returns hits grouped by query
+            hit_queries, hit_points = hit_queries[0], hit_points[0]
+            order = np.argsort(hit_queries, kind='stable')
+        elif hit_queries:
+            hit_queries, hit_points = np.concatenate(hit_queries), np.concatenate(hit_points)
+            order = np.lexsort((hit_points, hit_queries))
+        else:
+            return np.zeros(len(centers) + 1, dtype=np.int64), np.empty(0, dtype=np.int64)
+        indptr = np.zeros(len(centers) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(hit_queries, minlength=len(centers)), out=indptr[1:])
+        return indptr, hit_points[order]
+
+class SphereCellIndex:
+    # points bucketed by latitude/longitude cell; ids sorted by cell give each cell one
+    # contiguous run, and the cells of a latitude band one run per longitude range
+    def __init__(self, points=None, cell_degrees=CELL_DEGREES):
+        step = math.radians(cell_degrees)
+        self.num_lat = int(math.ceil(math.pi / step))
+        self.num_lon = int(math.ceil(2 * math.pi / step))
+        # cells as even as the counts allow, a little under cell_degrees when it does not divide 180 or 360
+        self.lat_step = math.pi / self.num_lat
+        self.lon_step = 2 * math.pi / self.num_lon
+        self.points = np.empty((0, 3), dtype=np.float64)
+        self.radii = np.empty(0, dtype=np.float64)
+        self._deleted = np.zeros(0, dtype=bool)
+        self.num_points = 0
+        self.num_deleted = 0
+        # inserted chunks not yet sorted into the cells, merged on the next query
+        self._pending = []
+        self.cell_start = np.zeros(self.num_lat * self.num_lon + 1, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int64)
+        if points is not None:
+            self.insert(points)
+
+    @classmethod
+    def fromArrays(cls, points, ids, cell_start, cell_degrees=CELL_DEGREES):
+        # an index over points from the sorted ids and cell offsets of an earlier build;
+        # points is only read, the first insert moves everything into a new buffer
+        index = cls(cell_degrees=cell_degrees)
+        index.points = points
+        index.radii = np.linalg.norm(points, axis=1)
+        index._deleted = np.zeros(len(points), dtype=bool)
+        index.num_points = len(points)
+        index.ids = ids
+        index.cell_start = cell_start
+        return index
+
+    def __len__(self):
+        return self.num_points - self.num_deleted
+
+    @property
+    def deleted(self):
+        return self._deleted[:self.num_points]
+
+    def cellOf(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        norms = np.linalg.norm(points, axis=1)
+        lat = np.arcsin(np.clip(points[:, 2] / np.where(norms > 0, norms, 1.0), -1.0, 1.0))
+        lon = np.arctan2(points[:, 1], points[:, 0])
+        i = np.minimum(((lat + math.pi / 2) / self.lat_step).astype(np.int64), self.num_lat - 1)
+        j = ((lon + math.pi) / self.lon_step).astype(np.int64) % self.num_lon
+        return i * self.num_lon + j
+
+    def capRanges(self, direction, angle):
+        # inclusive (first, last) cell ranges covering the spherical cap of the given
+        # angular radius around a unit direction, one or two per latitude band
+        if angle < 0:
+            return []
+        angle += 1e-9
+        lat0 = math.asin(max(-1.0, min(1.0, direction[2])))
+        lon0 = math.atan2(direction[1], direction[0])
+        first_band = max(0, int((lat0 - angle + math.pi / 2) // self.lat_step))
+        last_band = min(self.num_lat - 1, int((lat0 + angle + math.pi / 2) // self.lat_step))
+        full = lat0 + angle >= math.pi / 2 or lat0 - angle <= -math.pi / 2
+        if not full:
+            # longitude half-width of the cap, widest at the latitude of its center
+            half = math.asin(min(1.0, math.sin(angle) / math.cos(lat0)))
+            first_lon = int((lon0 - half + math.pi) // self.lon_step)
+            last_lon = int((lon0 + half + math.pi) // self.lon_step)
+            full = last_lon - first_lon + 1 >= self.num_lon
+            first_lon %= self.num_lon
+            last_lon %= self.num_lon
+        ranges = []
+        for band in range(first_band, last_band + 1):
+            base = band * self.num_lon
+            if full:
+                ranges.append((base, base + self.num_lon - 1))
+            elif first_lon <= last_lon:
+                ranges.append((base + first_lon, base + last_lon))
+            else:
+                ranges.append((base + first_lon, base + self.num_lon - 1))
+                ranges.append((base, base + last_lon))
+        return ranges
+
+    def capCells(self, direction, angle):
+        ranges = self.capRanges(direction, angle)
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(first, last + 1) for first, last in ranges])
+
+    def insert(self, points):
+        # returns the ids given to the new points, which continue from the last insert
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+        ids = np.arange(self.num_points, self.num_points + len(points), dtype=np.int64)
+        if self.num_points + len(points) > len(self._deleted):
+            capacity = 2 * (self.num_points + len(points))
+            deleted = np.zeros(capacity, dtype=bool)
+            deleted[:self.num_points] = self.deleted
+            self._deleted = deleted
+            buffer = np.empty((capacity, 3), dtype=np.float64)
+            buffer[:self.num_points] = self.points[:self.num_points]
+            self.points = buffer
+            radii = np.empty(capacity, dtype=np.float64)
+            radii[:self.num_points] = self.radii[:self.num_points]
+            self.radii = radii
+        self.points[ids] = points
+        self.radii[ids] = np.linalg.norm(points, axis=1)
+        self.num_points += len(points)
+        self._pending.append(ids)
+        return ids
+
+    def delete(self, ids):
+        # deleted ids stay in their cell and are filtered out of query results
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ids = ids[~self._deleted[ids]]
+        self._deleted[ids] = True
+        self.num_deleted += len(ids)
+
+    def _sortPending(self):
+        if not self._pending:
             return
-        dist = math.sqrt(sum([pow(node.point[i] - center[i], 2) for i in range(3)]))
-        if dist <= r:
-            indices.add(node.point)
-        if node.left is not None and center[node.axis] - r <= node.point[node.axis]:
-            self._ball_query(node.left, center, r, indices)
-        if node.right is not None and center[node.axis] + r >= node.point[node.axis]:
-            self._ball_query(node.right, center, r, indices)
+        ids = np.concatenate([self.ids[~self._deleted[self.ids]]] + self._pending)
+        cells = self.cellOf(self.points[ids])
+        order = np.argsort(cells, kind='stable')
+        self.ids = ids[order]
+        self.cell_start = np.zeros(self.num_lat * self.num_lon + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.num_lat * self.num_lon), out=self.cell_start[1:])
+        self._pending = []
+
+    def minRadius(self):
+        alive = ~self.deleted
+        return float(self.radii[:self.num_points][alive].min()) if alive.any() else math.inf
+
+    def cone_query_csr(self, centers):
+        # ids of the points that see each center within USER_ANGLE_DEGREES of their own
+        # zenith, whatever their radius: candidates from the cells of the widest cap, the
+        # one for the lowest point, then an exact check per point; returns (indptr, indices)
+        self._sortPending()
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        distances = np.linalg.norm(centers, axis=1)
+        angles = visibilityAngle(self.minRadius(), distances) if len(self) else np.full(len(centers), -1.0)
+        rows, candidates = [], []
+        for j, (center, distance, angle) in enumerate(zip(centers.tolist(), distances.tolist(), angles.tolist())):
+            runs = [self.ids[self.cell_start[first]:self.cell_start[last + 1]]
+                    for first, last in self.capRanges([c / distance for c in center], angle)]
+            if runs:
+                runs = np.concatenate(runs)
+                candidates.append(runs)
+                rows.append(np.full(len(runs), j, dtype=np.int64))
+        indptr = np.zeros(len(centers) + 1, dtype=np.int64)
+        if not candidates:
+            return indptr, np.empty(0, dtype=np.int64)
+        candidates, rows = np.concatenate(candidates), np.concatenate(rows)
+        visible = withinUserCone(self.points[candidates], centers[rows]) & ~self._deleted[candidates]
+        candidates, rows = candidates[visible], rows[visible]
+        order = np.lexsort((candidates, rows))
+        np.cumsum(np.bincount(rows, minlength=len(centers)), out=indptr[1:])
+        return indptr, candidates[order]
 
 class StarlinkManager:
-    def __init__(self, user_coords, satellite_coords):
-        self.kdtree = KDTree(user_coords)
-        self.users = [User(i, *user_coord) for i, user_coord in enumerate(user_coords)]
-        self.r = math.sqrt(user_coords[0][0] ** 2 + user_coords[0][1] ** 2 + user_coords[0][2] ** 2)
-        self.point_to_user_mapping = {user_coord : user for user_coord, user in zip(user_coords, self.users)}
-        self.satellites = [Satellite(j, *satellite_coord, visible_users=None) for j, satellite_coord in enumerate(satellite_coords)]
-        self.unassigned_users = set(self.users)
-        for satellite in self.satellites:
-            visible_users = self.findSatelliteEligibleUsers(satellite)
-            satellite.addUsersCanConnect(visible_users)
+    def __init__(self, user_coords, satellite_coords, visibility=None, seed=None, index='auto'):
+        # all solver randomness comes from this generator, so equal seeds give equal runs
+        self.rng = random.Random(seed)
+        self.user_coords = np.ascontiguousarray(user_coords, dtype=np.float64).reshape(-1, 3)
+        # a copy, since updateSatellites moves satellites in place and the input may be read-only
+        self.satellite_coords = np.array(satellite_coords, dtype=np.float64).reshape(-1, 3)
+        self.index = _resolveIndex(self.user_coords, index)
+        self._kdtree = None
+        self._cells = None
+        self._satellite_index = None
+        # name -> (array, .npy path) for arrays that a cache file holds a copy of
+        self._cache_files = {}
+        # spare capacity behind the per-user arrays so that added users append in amortized O(1)
+        self._user_buffers = {}
+        self.users = UserTable(self.user_coords)
+        # the users' radius; with no users yet, addUsers takes it from the first to join
+        self.r = float(np.linalg.norm(self.user_coords[0])) if len(self.user_coords) else 1.0
+        # assignment state: serving satellite id and color value per user, -1 when unassigned
+        self.user_satellite = np.full(len(self.user_coords), -1, dtype=np.int32)
+        self.user_color = np.full(len(self.user_coords), -1, dtype=np.int8)
+        # removed users keep their id but are no longer visible to any satellite
+        self.user_alive = np.ones(len(self.user_coords), dtype=bool)
+        # satellite -> user visibility as a CSR matrix, queried for every satellite in one batched
+        # pass unless a precomputed (indptr, indices) pair is given
+        if visibility is None:
+            visibility = self.queryVisibility(self.satellite_coords)
+        self._visibility = visibility
+        indptr, indices = visibility
+        self.satellites = [
+            Satellite(j, x, y, z, indices[indptr[j]:indptr[j + 1]], self.users)
+            for j, (x, y, z) in enumerate(self.satellite_coords.tolist())
+        ]
+
+    @property
+    def kdtree(self):
+        if self._kdtree is None:
+            self._kdtree = KDForest(self.user_coords)
+            self._kdtree.delete(np.nonzero(~self.user_alive)[0])
+        return self._kdtree
+
+    @classmethod
+    def cached(cls, user_coords, satellite_coords, cache_dir, seed=None, index='auto'):
+        # like the constructor, but the visibility and the user index are memory-mapped from
+        # cache_dir when these coordinates have been seen before, and saved there otherwise
+        user_coords = np.ascontiguousarray(user_coords, dtype=np.float64).reshape(-1, 3)
+        satellite_coords = np.ascontiguousarray(satellite_coords, dtype=np.float64).reshape(-1, 3)
+        index = _resolveIndex(user_coords, index)
+        path = os.path.join(cache_dir, cacheKey(user_coords, satellite_coords, index))
+        if not os.path.isdir(path):
+            manager = cls(user_coords, satellite_coords, seed=seed, index=index)
+            manager.saveCache(cache_dir)
+            return manager
+
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        manager = cls(user_coords, satellite_coords, visibility=(load('visible_indptr'), load('visible_indices')), seed=seed, index=index)
+        if index == 'kdtree':
+            arrays = {name: load('kdtree_' + name) for name in KDTree.ARRAYS}
+            manager._kdtree = KDForest.fromTree(KDTree.fromArrays(manager.user_coords, arrays))
+        else:
+            manager._cells = SphereCellIndex.fromArrays(manager.user_coords, load('cell_ids'), load('cell_start'))
+        manager._recordCacheFiles(path)
+        return manager
+
+    def saveCache(self, cache_dir):
+        # write the visibility CSR and the built user index as .npy files under the
+        # cache key, returning their directory
+        if not self.user_alive.all():
+            raise ValueError("cannot cache the index of a manager with removed users")
+        path = os.path.join(cache_dir, cacheKey(self.user_coords, self.satellite_coords, self.index))
+        if not os.path.isdir(path):
+            arrays = {'user_coords': self.user_coords, 'visible_indptr': self.visible_indptr, 'visible_indices': self.visible_indices}
+            if self.index == 'kdtree':
+                # added users leave several trees, cache them merged into one
+                if len(self.kdtree.trees) > 1:
+                    self.kdtree.rebuild()
+                tree = self.kdtree.trees[0][0] if self.kdtree.trees else KDTree(self.user_coords)
+                arrays.update({'kdtree_' + name: getattr(tree, name) for name in KDTree.ARRAYS})
+            else:
+                self.cells._sortPending()
+                arrays.update({'cell_ids': self.cells.ids, 'cell_start': self.cells.cell_start})
+            os.makedirs(cache_dir, exist_ok=True)
+            # written aside and renamed into place, so readers never see a partial entry
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=cache_dir)
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, name + '.npy'), array)
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # another process saved the same entry first
+                shutil.rmtree(staging)
+        self._recordCacheFiles(path)
+        return path
+
+    def _recordCacheFiles(self, path):
+        visibility = self.visibility()
+        arrays = {'user_coords': self.user_coords, 'visible_indptr': visibility[0], 'visible_indices': visibility[1]}
+        self._cache_files = {name: (array, os.path.join(path, name + '.npy')) for name, array in arrays.items()}
+
+    @property
+    def cells(self):
+        if self._cells is None:
+            self._cells = SphereCellIndex(self.user_coords)
+            self._cells.delete(np.nonzero(~self.user_alive)[0])
+        return self._cells
+
+    def queryVisibility(self, satellite_coords):
+        # live users visible to each satellite, as (indptr, indices)
+        if self.index == 'cells':
+            return self.cells.cone_query_csr(satellite_coords)
+        radii = self.criticalRadius(np.linalg.norm(satellite_coords, axis=1))
+        return self.kdtree.ball_query_csr(satellite_coords, radii)
+
+    @property
+    def visible_indptr(self):
+        return self.visibility()[0]
+
+    @property
+    def visible_indices(self):
+        return self.visibility()[1]
+
+    def visibility(self):
+        # the CSR matrix is regathered from the satellites' rows after they change
+        if self._visibility is None:
+            self.rebuildVisibility()
+        return self._visibility
+
+    def satelliteIndex(self):
+        # for finding the satellites that can see given users: a k-d tree over satellite
+        # positions with each satellite's critical radius, or with the cell index a CSR
+        # map of cell -> satellites whose widest cap, the one for the lowest user, covers it
+        if self._satellite_index is None:
+            distances = np.linalg.norm(self.satellite_coords, axis=1)
+            if self.index == 'cells':
+                min_radius = self.cells.minRadius()
+                cells = [self.cells.capCells(coords / distance, angle) for coords, distance, angle
+                         in zip(self.satellite_coords, distances, visibilityAngle(min_radius, distances))]
+                satellite_ids = np.repeat(np.arange(len(cells)), [len(c) for c in cells])
+                cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+                order = np.argsort(cells, kind='stable')
+                cell_start = np.zeros(self.cells.num_lat * self.cells.num_lon + 1, dtype=np.int64)
+                np.cumsum(np.bincount(cells, minlength=len(cell_start) - 1), out=cell_start[1:])
+                self._satellite_index = (cell_start, satellite_ids[order], min_radius)
+            else:
+                self._satellite_index = (KDTree(self.satellite_coords), self.criticalRadius(distances))
+        return self._satellite_index
+
+    def findUserEligibleSatellites(self, user_ids):
+        # map of satellite id -> sorted ids of the given users it can see
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if len(user_ids) == 0 or len(self.satellites) == 0:
+            return {}
+        if self.index == 'cells':
+            # users below the lowest one the cell map was built for see wider caps
+            if np.linalg.norm(self.user_coords[user_ids], axis=1).min() < self.satelliteIndex()[2]:
+                self._satellite_index = None
+            cell_start, cell_satellites, _ = self.satelliteIndex()
+            # one cell lookup per user, then the exact check against each satellite listed there
+            cells = self.cells.cellOf(self.user_coords[user_ids])
+            counts = cell_start[cells + 1] - cell_start[cells]
+            users = np.repeat(user_ids, counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            satellite_ids = cell_satellites[np.repeat(cell_start[cells], counts) + offsets]
+            visible = withinUserCone(self.user_coords[users], self.satellite_coords[satellite_ids])
+        else:
+            tree, radii = self.satelliteIndex()
+            indptr, satellite_ids = tree.ball_query_csr(self.user_coords[user_ids], radii.max())
+            users = np.repeat(user_ids, np.diff(indptr))
+            visible = np.linalg.norm(self.satellite_coords[satellite_ids] - self.user_coords[users], axis=1) <= radii[satellite_ids]
+        users, satellite_ids = users[visible], satellite_ids[visible]
+        order = np.lexsort((users, satellite_ids))
+        users, satellite_ids = users[order], satellite_ids[order]
+        starts = np.nonzero(np.diff(satellite_ids, prepend=-1))[0]
+        return {j: row for j, row in zip(satellite_ids[starts].tolist(), np.split(users, starts[1:]))}
+
+    def _appendUserRows(self, name, rows):
+        current = getattr(self, name)
+        n = len(current)
+        buffer = self._user_buffers.get(name)
+        if buffer is None or n + len(rows) > len(buffer):
+            buffer = np.empty((max(2 * (n + len(rows)), 16),) + current.shape[1:], dtype=current.dtype)
+            buffer[:n] = current
+            self._user_buffers[name] = buffer
+        buffer[n:n + len(rows)] = rows
+        setattr(self, name, buffer[:n + len(rows)])
+
+    def addUsers(self, user_coords):
+        # add users without rebuilding the index, patching only the satellites that see them
+        user_coords = np.ascontiguousarray(user_coords, dtype=np.float64).reshape(-1, 3)
+        if len(self.user_coords) == 0 and len(user_coords):
+            self.r = float(np.linalg.norm(user_coords[0]))
+            self._satellite_index = None
+        if self.index == 'kdtree' and len(user_coords) and not np.allclose(np.linalg.norm(user_coords, axis=1), self.r, rtol=1e-9, atol=0):
+            # the critical radius no longer holds for every user
+            self.index = 'cells'
+            self._satellite_index = None
+        user_ids = np.arange(len(self.user_coords), len(self.user_coords) + len(user_coords), dtype=np.int64)
+        # indexes that have not been built yet pick the users up from user_coords later
+        for index in (self._kdtree, self._cells):
+            if index is not None:
+                index.insert(user_coords)
+        self._appendUserRows('user_coords', user_coords)
+        self._appendUserRows('user_satellite', np.full(len(user_ids), -1, dtype=np.int32))
+        self._appendUserRows('user_color', np.full(len(user_ids), -1, dtype=np.int8))
+        self._appendUserRows('user_alive', np.ones(len(user_ids), dtype=bool))
+        self.users.extend(self.user_coords)
+        for j, new_users in self.findUserEligibleSatellites(user_ids).items():
+            satellite = self.satellites[j]
+            satellite.addUsersCanConnect(np.concatenate([satellite.visible_users, new_users]))
+        self._visibility = None
+        return user_ids
+
+    def removeUsers(self, user_ids):
+        # drop users from the index, their connections and the satellites that see them
+        user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+        user_ids = user_ids[self.user_alive[user_ids]]
+        for user_id in user_ids[self.user_satellite[user_ids] >= 0].tolist():
+            user = self.users[user_id]
+            self.disconnect(self.satellites[self.user_satellite[user_id]], user.current_connection)
+        for j, gone in self.findUserEligibleSatellites(user_ids).items():
+            satellite = self.satellites[j]
+            satellite.addUsersCanConnect(np.setdiff1d(satellite.visible_users, gone, assume_unique=True))
+        self.user_alive[user_ids] = False
+        for index in (self._kdtree, self._cells):
+            if index is not None:
+                index.delete(user_ids)
+        self._visibility = None
+        return user_ids
+
+    def criticalRadius(self, d):
+        return criticalRadius(self.r, d)
 
     def findSatelliteEligibleUsers(self, satellite):
+        if self.index == 'cells':
+            return self.cells.cone_query_csr((satellite.x, satellite.y, satellite.z))[1]
         self.d = math.sqrt(satellite.x ** 2 + satellite.y ** 2 + satellite.z ** 2)
-        # critical radius to query k-d tree, worked out using geometry
-        critical_radius = math.sqrt(2) * self.d * math.sin(math.pi / 4 - math.asin(1/math.sqrt(2) * self.r / self.d))
-        points = self.kdtree.ball_query((satellite.x, satellite.y, satellite.z),critical_radius)
-        return set(self.point_to_user_mapping[point] for point in points)
-
-    def randomInit(self):
-        for satellite in self.satellites:
-            # get unassigned users for the current satellite
-            for _ in range(32):
-                unassigned_users = satellite.visible_users.intersection(self.unassigned_users)
-                if len(unassigned_users) == 0:
-                    break # break out of inner loop
-                # randomly select an unassigned user and assign a random color
-                user = random.choice(list(unassigned_users))
-                color = random.choice(list(Colors))
-                connection = SatelliteConnection(satellite.id, len(satellite.current_connections) + 1, user, color)
-                satellite.addConnection(connection)
-                user.current_connection = connection
-                self.unassigned_users.remove(user)
-
-    def minConflicts(self, max_steps):
+        return self.kdtree.ball_query_indices((satellite.x, satellite.y, satellite.z), self.criticalRadius(self.d))
+
+    def connect(self, satellite, connection):
+        satellite.addConnection(connection)
+        connection.user.current_connection = connection
+        self.user_satellite[connection.user.id] = satellite.id
+        self.user_color[connection.user.id] = connection.color.value
+
+    def disconnect(self, satellite, connection):
+        satellite.removeConnection(connection)
+        self.release(connection.user)
+
+    def release(self, user):
+        user.current_connection = None
+        self.user_satellite[user.id] = -1
+        self.user_color[user.id] = -1
+
+    def randomInit(self, satellites=None):
+        for satellite in self.satellites if satellites is None else satellites:
+            free_beams = satellite.freeBeams()
+            if not free_beams:
+                continue
+            # randomly select unassigned users for the free beams and assign each a random color
+            unassigned_users = satellite.unassignedVisibleUsers(self.user_satellite).tolist()
+            for conn_id, user_id in zip(free_beams, self.rng.sample(unassigned_users, min(len(free_beams), len(unassigned_users)))):
+                color = self.rng.choice(list(Colors))
+                connection = SatelliteConnection(satellite.id, conn_id, self.users[user_id], color)
+                self.connect(satellite, connection)
+
+    def greedyInit(self, satellites=None):
+        # users seen by the fewest satellites go first so contested users are not used up
+        contention = np.bincount(self.visible_indices, minlength=len(self.user_coords))
+        for satellite in self.satellites if satellites is None else satellites:
+            free_beams = satellite.freeBeams()
+            free = self.user_satellite[satellite.visible_users] < 0
+            if not free_beams or not free.any():
+                continue
+            candidates = satellite.visible_users[free]
+            directions = satellite.beamDirections()[free]
+
+            # within equal contention, sweep the candidates by azimuth around the nadir
+            nadir = -np.array([satellite.x, satellite.y, satellite.z]) / math.sqrt(satellite.x ** 2 + satellite.y ** 2 + satellite.z ** 2)
+            east = np.cross(nadir, (0, 0, 1)) if abs(nadir[2]) < 0.9 else np.cross(nadir, (1, 0, 0))
+            north = np.cross(nadir, east)
+            azimuth = np.arctan2(directions @ north, directions @ east)
+            order = np.lexsort((azimuth, contention[candidates]))
+
+            # bitmask per candidate of the colors that would conflict with an existing beam
+            blocked = satellite.blockedColors(directions)
+            color_use = satellite.colorUse()
+            for conn_id in free_beams:
+                open_candidates = np.flatnonzero(blocked[order] != ALL_COLORS)
+                if len(open_candidates) == 0:
+                    break
+                index = order[open_candidates[0]]
+                self.placeBeam(satellite, conn_id, candidates, directions, blocked, color_use, index)
+
+    def placeBeam(self, satellite, conn_id, candidates, directions, blocked, color_use, index, color=None):
+        # connect the candidate at index with the given color, or if that is blocked the least used
+        # color that stays conflict free, then block that color for the candidates near it;
+        # directions and blocked are aligned with candidates, color_use is updated in place
+        if color is None or blocked[index] >> color & 1:
+            color = min((c for c in range(len(Colors)) if not blocked[index] >> c & 1), key=lambda c: color_use[c])
+        self.connect(satellite, SatelliteConnection(satellite.id, conn_id, self.users[int(candidates[index])], Colors(color)))
+        blocked[directions @ directions[index] > SATELLITE_ANGLE_COSINE] |= 1 << color
+        blocked[index] = ALL_COLORS
+        color_use[color] += 1
+
+    def coarseInit(self, satellites=None, cell_degrees=COARSE_CELL_DEGREES):
+        # coarse to fine: bucket the unassigned users into angular cells, solve the much smaller
+        # problem over one representative per cell, repeated as often as the cell can expect
+        # beams, then hand each coarse beam to a free user of its cell that keeps it conflict free
+        satellites = [satellite for satellite in (self.satellites if satellites is None else satellites)
+                      if len(satellite.current_connections) < MAX_BEAMS]
+        rows = [satellite.unassignedVisibleUsers(self.user_satellite) for satellite in satellites]
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        if lengths.sum() == 0:
+            return
+        row_users = np.concatenate(rows)
+        row_starts = np.cumsum(lengths) - lengths
+        users, row_users = np.unique(row_users, return_inverse=True)
+
+        # dense cell numbers, and per cell its representative, the mean position scaled back to
+        # the users' mean radius, and its demand, the number of users in it
+        cells, user_cell = np.unique(SphereCellIndex(cell_degrees=cell_degrees).cellOf(self.user_coords[users]), return_inverse=True)
+        demand = np.bincount(user_cell, minlength=len(cells))
+        coords = self.user_coords[users]
+        sums = np.stack([np.bincount(user_cell, weights=coords[:, axis], minlength=len(cells)) for axis in range(3)], axis=1)
+        radii = np.bincount(user_cell, weights=np.linalg.norm(coords, axis=1), minlength=len(cells)) / demand
+        representatives = sums / np.linalg.norm(sums, axis=1, keepdims=True) * radii[:, None]
+        row_cells = user_cell[row_users]
+
+        # (satellite, cell) pairs where the satellite sees any user of the cell, ordered by satellite
+        pairs = np.unique(np.repeat(np.arange(len(rows)), lengths) * len(cells) + row_cells)
+        pair_satellites, pair_cells = np.divmod(pairs, len(cells))
+        # each satellite offers a cell at most one beam per color, and twice its even share of
+        # its free beams, so dense regions shrink to a few copies per cell
+        free_beams = np.array([MAX_BEAMS - len(satellite.current_connections) for satellite in satellites])
+        share = np.minimum(len(Colors), 2 * free_beams / np.maximum(np.bincount(pair_satellites, minlength=len(rows)), 1))
+        expected = np.ceil(np.bincount(pair_cells, weights=share[pair_satellites], minlength=len(cells))).astype(np.int64)
+        copies = np.minimum(demand, expected)
+        copy_start = np.cumsum(copies) - copies
+        pair_copies = copies[pair_cells]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_satellites, weights=pair_copies, minlength=len(rows)).astype(np.int64), out=indptr[1:])
+        indices = np.repeat(copy_start[pair_cells], pair_copies) + np.arange(pair_copies.sum()) - np.repeat(np.cumsum(pair_copies) - pair_copies, pair_copies)
+
+        coarse = StarlinkManager(np.repeat(representatives, copies, axis=0), [(s.x, s.y, s.z) for s in satellites],
+                                 visibility=(indptr, indices), seed=self.rng.getrandbits(32), index=self.index)
+        coarse.solve(init='greedy')
+
+        copy_cells = np.repeat(np.arange(len(cells)), copies)
+        for k, (coarse_satellite, satellite) in enumerate(zip(coarse.satellites, satellites)):
+            connections = list(coarse_satellite.current_connections)
+            if not connections:
+                continue
+            # the satellite's still free users in the cells it beams to, by cell, nearest the representative first
+            row = rows[k]
+            row_cell = row_cells[row_starts[k]:row_starts[k] + len(row)]
+            wanted = np.isin(row_cell, copy_cells[[conn.user.id for conn in connections]]) & (self.user_satellite[row] < 0)
+            row, row_cell = row[wanted], row_cell[wanted]
+            order = np.lexsort((np.linalg.norm(self.user_coords[row] - representatives[row_cell], axis=1), row_cell))
+            row, row_cell = row[order], row_cell[order]
+            directions = self.user_coords[row] - (satellite.x, satellite.y, satellite.z)
+            directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+            blocked = satellite.blockedColors(directions)
+            color_use = satellite.colorUse()
+            # a satellite that already has beams only fills its free ones
+            free_beams = satellite.freeBeams()
+            for conn in connections:
+                if not free_beams:
+                    break
+                cell = copy_cells[conn.user.id]
+                first, last = np.searchsorted(row_cell, [cell, cell + 1])
+                # the nearest user that allows the coarse color, otherwise the nearest with any open color
+                options = first + np.flatnonzero(blocked[first:last] >> conn.color.value & 1 == 0)
+                if len(options) == 0:
+                    options = first + np.flatnonzero(blocked[first:last] != ALL_COLORS)
+                    if len(options) == 0:
+                        continue
+                self.placeBeam(satellite, free_beams.pop(0), row, directions, blocked, color_use, options[0], conn.color.value)
+
+    def initialize(self, init, satellites=None):
+        if init == 'random':
+            self.randomInit(satellites)
+        elif init == 'greedy':
+            self.greedyInit(satellites)
+        elif init == 'coarse':
+            self.coarseInit(satellites)
+        else:
+            raise ValueError(f"unknown initializer {init!r}, expected 'random', 'greedy' or 'coarse'")
+
+    def minConflicts(self, max_steps=None, satellites=None, stats=None, patience=None, time_limit=None, target_conflicts=0):
+        # with patience set, stop once the number of conflicted connections has not
+        # improved for that many sweeps; time_limit is a wall-clock budget in seconds
+        satellites = self.satellites if satellites is None else satellites
+        if max_steps is None:
+            max_steps = 2 * MAX_BEAMS * len(self.satellites)
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        best_conflicts, stalled = None, 0
         for _ in range(max_steps):
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            # only satellites with conflicts take a step, stop once none are left
+            order = [satellite for satellite in satellites if satellite.numConflictedConnections() > 0]
+            if stats is not None or patience is not None or target_conflicts > 0:
+                conflicts = sum(satellite.numConflictedConnections() for satellite in order)
+                if stats is not None:
+                    stats.recordSweep(conflicts, len(satellites) - len(order))
+                if best_conflicts is None or conflicts < best_conflicts:
+                    best_conflicts, stalled = conflicts, 0
+                else:
+                    stalled += 1
+                if patience is not None and stalled >= patience:
+                    break
+                if conflicts <= target_conflicts:
+                    break
+            if not order:
+                break
             # shuffle satellites randomly
-            random.shuffle(self.satellites)
+            self.rng.shuffle(order)
             # loop through all satellites
-            for satellite in self.satellites:
+            for satellite in order:
                 # find a random conflicted connection
-                conflict_connections = satellite.findRandomConflictedConnection()
+                conflict_connections = satellite.findRandomConflictedConnection(self.rng)
                 if conflict_connections is not None:
                     # get the alternative connection with the minimum conflicts
-                    alternative_connection = satellite.getAlternativeMinConflictConnection(conflict_connections[0], self.unassigned_users)
+                    alternative_connection = satellite.getAlternativeMinConflictConnection(conflict_connections[0], self.user_satellite, self.rng)
                     # remove the conflicted connection and add the alternative connection
-                    satellite.removeConnection(conflict_connections[0])
-                    satellite.addConnection(alternative_connection)
+                    self.disconnect(satellite, conflict_connections[0])
+                    self.connect(satellite, alternative_connection)
+
+    def anneal(self, max_steps=None, satellites=None, stats=None, time_limit=None, target_conflicts=0,
+               start_temperature=2.0, end_temperature=0.05):
+        # simulated annealing over single-connection moves, each step re-assigns a random conflicted
+        # connection to a random candidate user and color; stops at the step or time budget, or once
+        # at most target_conflicts connections are conflicted, and leaves the best state it saw
+        satellites = self.satellites if satellites is None else satellites
+        if max_steps is None and time_limit is None:
+            max_steps = 2 * MAX_BEAMS * MAX_BEAMS * len(satellites)
+        start = time.perf_counter()
+        # satellites with conflicts, as a list plus positions for O(1) sampling and removal
+        active = [satellite for satellite in satellites if satellite.numConflictedConnections() > 0]
+        active_index = {satellite: position for position, satellite in enumerate(active)}
+        conflicts = sum(satellite.numConflictedConnections() for satellite in active)
+        # best is None while the current state is the best one seen, it is only copied
+        # before a worsening move leaves it
+        best_conflicts, best = conflicts, None
+        temperature = start_temperature
+        colors = list(Colors)
+        step = 0
+        while active and conflicts > target_conflicts:
+            if max_steps is not None and step >= max_steps:
+                break
+            if step % 64 == 0:
+                progress = 0.0 if max_steps is None else step / max_steps
+                if time_limit is not None:
+                    elapsed = time.perf_counter() - start
+                    if elapsed >= time_limit:
+                        break
+                    progress = max(progress, elapsed / time_limit)
+                temperature = start_temperature * (end_temperature / start_temperature) ** progress
+                if stats is not None and step % (64 * len(satellites)) == 0:
+                    stats.recordSweep(conflicts, len(satellites) - len(active))
+            step += 1
+
+            satellite = self.rng.choice(active)
+            old = satellite.findRandomConflictedConnection(self.rng)[0]
+            # half of the moves recolor the current user, the rest swap in an unassigned visible user
+            user = old.user
+            if self.rng.random() < 0.5:
+                free = satellite.unassignedVisibleUsers(self.user_satellite)
+                if len(free):
+                    user = self.users[int(free[self.rng.randrange(len(free))])]
+            new = SatelliteConnection(satellite.id, old.conn_id, user, self.rng.choice(colors))
+            before = satellite.numConflictedConnections()
+            self.disconnect(satellite, old)
+            self.connect(satellite, new)
+            delta = satellite.numConflictedConnections() - before
+            if delta > 0:
+                if self.rng.random() >= math.exp(-delta / temperature):
+                    self.disconnect(satellite, new)
+                    self.connect(satellite, old)
+                    continue
+                if best is None and conflicts == best_conflicts:
+                    self.disconnect(satellite, new)
+                    self.connect(satellite, old)
+                    best = self.snapshot(satellites)
+                    self.disconnect(satellite, old)
+                    self.connect(satellite, new)
+            conflicts += delta
+            if conflicts < best_conflicts:
+                best_conflicts, best = conflicts, None
+
+            if satellite.numConflictedConnections() == 0:
+                position = active_index.pop(satellite)
+                last = active.pop()
+                if last is not satellite:
+                    active[position] = last
+                    active_index[last] = position
+            elif satellite not in active_index:
+                active_index[satellite] = len(active)
+                active.append(satellite)
+            # conflicts only change within the satellite the move was made on
+
+        if best is not None and conflicts > best_conflicts:
+            self.restore(best)
+        if stats is not None:
+            stats.recordSweep(min(conflicts, best_conflicts), len(satellites) - sum(1 for satellite in satellites if satellite.numConflictedConnections() > 0))
+
+    def snapshot(self, satellites=None):
+        # the connections of each satellite, enough to restore them later
+        return [
+            (satellite, [(conn.conn_id, conn.user, conn.color) for conn in satellite.current_connections])
+            for satellite in (self.satellites if satellites is None else satellites)
+        ]
+
+    def restore(self, snapshot):
+        for satellite, _ in snapshot:
+            for conn in list(satellite.current_connections):
+                self.disconnect(satellite, conn)
+        for satellite, connections in snapshot:
+            for conn_id, user, color in connections:
+                self.connect(satellite, SatelliteConnection(satellite.id, conn_id, user, color))
+
+    def optimize(self, solver, max_steps=None, satellites=None, stats=None, patience=None, time_limit=None, target_conflicts=0):
+        # max_steps counts sweeps for minConflicts and single moves for anneal
+        if solver == 'minConflicts':
+            self.minConflicts(max_steps, satellites, stats, patience, time_limit, target_conflicts)
+        elif solver == 'anneal':
+            self.anneal(max_steps, satellites, stats, time_limit, target_conflicts)
+        else:
+            raise ValueError(f"unknown solver {solver!r}, expected 'minConflicts' or 'anneal'")
         
-    def cleanUp(self):
-        for satellite in self.satellites:
-            satellite.removeConflictingConnections()
+    def cleanUp(self, satellites=None):
+        # returns the number of connections dropped
+        dropped = 0
+        for satellite in self.satellites if satellites is None else satellites:
+            for connection in satellite.removeConflictingConnections():
+                self.release(connection.user)
+                dropped += 1
+        return dropped
+
+    def refill(self, satellites=None):
+        # fill the beams left free after cleanUp: a maximum matching of unassigned users to free
+        # beams, over the users each satellite can still give a conflict free color; users matched
+        # to one satellite can block each other, so the matching is repeated until nothing is added
+        satellites = self.satellites if satellites is None else satellites
+        added = 0
+        while True:
+            candidates = {}
+            for satellite in satellites:
+                if len(satellite.current_connections) >= MAX_BEAMS:
+                    continue
+                free_beams = satellite.freeBeams()
+                free = self.user_satellite[satellite.visible_users] < 0
+                if not free.any():
+                    continue
+                directions = satellite.beamDirections()[free]
+                blocked = satellite.blockedColors(directions)
+                open_users = blocked != ALL_COLORS
+                if open_users.any():
+                    candidates[satellite] = (satellite.visible_users[free][open_users], directions[open_users], blocked[open_users], free_beams)
+            matching = _matchUsers({satellite: (users.tolist(), len(free_beams)) for satellite, (users, _, _, free_beams) in candidates.items()})
+
+            round_added = 0
+            for satellite, matched in matching.items():
+                users, directions, blocked, free_beams = candidates[satellite]
+                color_use = satellite.colorUse()
+                placed = 0
+                for index in np.searchsorted(users, sorted(matched)).tolist():
+                    if blocked[index] == ALL_COLORS:
+                        continue
+                    self.placeBeam(satellite, free_beams[placed], users, directions, blocked, color_use, index)
+                    placed += 1
+                    round_added += 1
+            added += round_added
+            if round_added == 0:
+                return added
+            # candidates only shrink, satellites without any are done
+            satellites = list(candidates)
+
+    def solve(self, max_steps=None, stats=None, patience=None, init='random', solver='minConflicts', time_limit=None, target_conflicts=0, refill=True):
+        with _phase(stats, f'{init}Init'):
+            self.initialize(init)
+        with _phase(stats, solver):
+            self.optimize(solver, max_steps, stats=stats, patience=patience, time_limit=time_limit, target_conflicts=target_conflicts)
+        with _phase(stats, 'cleanUp'):
+            dropped = self.cleanUp()
+        if stats is not None:
+            stats.dropped_connections += dropped
+        if refill:
+            with _phase(stats, 'refill'):
+                added = self.refill()
+            if stats is not None:
+                stats.refilled_connections += added
 
     def generateResult(self):
         result = []
@@ -227,10 +1293,366 @@ class StarlinkManager:
                 result.append((sat.id, conn.user.id))
         return result
 
-    def run(self):
-        self.randomInit()
-        N = 32 * len(self.satellites)
-        num_steps = 2 * N 
-        self.minConflicts(num_steps)
-        self.cleanUp()
-        return self.generateResult()
\ No newline at end of file
+    def updateSatellites(self, satellite_coords, visibility=None):
+        # move satellites to new positions, re-querying visibility only for the ones that moved;
+        # visibility, the (indptr, indices) rows of every satellite at the new positions as
+        # queryVisibility gives them, skips the query when it was batched ahead of time
+        satellite_coords = np.ascontiguousarray(satellite_coords, dtype=np.float64).reshape(-1, 3)
+        if satellite_coords.shape != self.satellite_coords.shape:
+            raise ValueError(f"expected coordinates for {len(self.satellites)} satellites, got {len(satellite_coords)}")
+        moved = np.nonzero(np.any(satellite_coords != self.satellite_coords, axis=1))[0]
+        if len(moved) == 0:
+            return moved
+        self.satellite_coords[moved] = satellite_coords[moved]
+        if visibility is None:
+            indptr, indices = self.queryVisibility(satellite_coords[moved])
+            rows = np.split(indices, indptr[1:-1])
+        else:
+            indptr, indices = visibility
+            rows = [indices[indptr[j]:indptr[j + 1]] for j in moved.tolist()]
+        for j in moved.tolist():
+            satellite = self.satellites[j]
+            satellite.x, satellite.y, satellite.z = satellite_coords[j].tolist()
+        self._setVisibleUsers(moved.tolist(), rows)
+        self._satellite_index = None
+        return moved
+
+    def setVisibility(self, visibility):
+        # give every satellite its (indptr, indices) row, queried ahead of time for its current position
+        indptr, indices = visibility
+        if len(indptr) != len(self.satellites) + 1:
+            raise ValueError(f"expected visibility for {len(self.satellites)} satellites, got {len(indptr) - 1}")
+        self._setVisibleUsers(range(len(self.satellites)), np.split(indices, indptr[1:-1]))
+
+    def _setVisibleUsers(self, satellite_ids, rows):
+        for j, visible_users in zip(satellite_ids, rows):
+            satellite = self.satellites[j]
+            satellite.addUsersCanConnect(visible_users)
+            # keep the connections whose users are still visible, conflicts are left for resolve() to repair
+            connections = list(satellite.current_connections)
+            still_visible = np.isin([conn.user.id for conn in connections], visible_users)
+            for conn, visible in zip(connections, still_visible.tolist()):
+                if not visible:
+                    self.release(conn.user)
+            satellite.current_connections = [conn for conn, visible in zip(connections, still_visible.tolist()) if visible]
+        self._visibility = None
+
+    def rebuildVisibility(self):
+        # gather the satellites' visible user rows back into one CSR matrix
+        rows = [satellite.visible_users for satellite in self.satellites]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=indptr[1:])
+        indices = np.concatenate(rows).astype(np.int64) if rows else np.empty(0, dtype=np.int64)
+        for j, satellite in enumerate(self.satellites):
+            satellite.visible_users = indices[indptr[j]:indptr[j + 1]]
+        self._visibility = (indptr, indices)
+
+    def resolve(self, max_steps=None, stats=None, patience=None, init='random', solver='minConflicts', time_limit=None, target_conflicts=0, refill=True):
+        # warm start from the current connections: fill free beams, then repair conflicts
+        self.solve(max_steps, stats, patience, init, solver, time_limit, target_conflicts, refill)
+        return self.result(stats)
+
+    def result(self, stats=None):
+        with _phase(stats, 'generateResult'):
+            result = self.generateResult()
+        if stats is not None:
+            stats.recordCoverage(self, result)
+        return result
+
+    def satelliteOverlaps(self):
+        # adjacency sets of the graph linking satellites that can see a common user
+        satellite_ids = np.repeat(np.arange(len(self.satellites)), np.diff(self.visible_indptr))
+        order = np.argsort(self.visible_indices, kind='stable')
+        users, satellite_ids = self.visible_indices[order], satellite_ids[order]
+        pairs = []
+        offset = 1
+        while offset < len(users):
+            same_user = users[offset:] == users[:-offset]
+            if not same_user.any():
+                break
+            pairs.append(np.stack([satellite_ids[:-offset][same_user], satellite_ids[offset:][same_user]], axis=1))
+            offset += 1
+        overlaps = [set() for _ in self.satellites]
+        if pairs:
+            for a, b in np.unique(np.concatenate(pairs), axis=0).tolist():
+                overlaps[a].add(b)
+                overlaps[b].add(a)
+        return overlaps
+
+    def satelliteRounds(self):
+        # greedy coloring of the overlap graph: satellites within a round share no
+        # visible users, so each round can be solved fully in parallel
+        overlaps = self.satelliteOverlaps()
+        round_of = {}
+        for j in sorted(range(len(overlaps)), key=lambda j: -len(overlaps[j])):
+            taken = {round_of[k] for k in overlaps[j] if k in round_of}
+            round_of[j] = next(r for r in range(len(taken) + 1) if r not in taken)
+        rounds = [[] for _ in range(max(round_of.values(), default=-1) + 1)]
+        for j in range(len(overlaps)):
+            rounds[round_of[j]].append(j)
+        return rounds
+
+    def runParallel(self, max_steps, workers, init='random', solver='minConflicts', time_limit=None, patience=None, target_conflicts=0):
+        # time_limit is shared out evenly over the rounds that are still left; patience and
+        # target_conflicts apply to each chunk of satellites a worker solves
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        segments, specs = self._shareSolverArrays()
+        # the assignment the workers start each round from, beams already in place included
+        assignment = np.ndarray(self.user_satellite.shape, self.user_satellite.dtype, buffer=segments[-2].buf)
+        colors = np.ndarray(self.user_color.shape, self.user_color.dtype, buffer=segments[-1].buf)
+        try:
+            with ProcessPoolExecutor(workers, initializer=_initSolverWorker, initargs=(specs,)) as executor:
+                rounds = self.satelliteRounds()
+                for position, satellite_ids in enumerate(rounds):
+                    round_limit = None if deadline is None else max(0.0, deadline - time.perf_counter()) / (len(rounds) - position)
+                    assignment[:] = self.user_satellite
+                    colors[:] = self.user_color
+                    chunks = [chunk.tolist() for chunk in np.array_split(satellite_ids, min(len(satellite_ids), 4 * workers))]
+                    n = len(chunks)
+                    # a seed per chunk so the result does not depend on which worker takes it
+                    seeds = [self.rng.randrange(2 ** 32) for _ in chunks]
+                    for solved in executor.map(_solveSatellites, chunks, seeds, [max_steps] * n, [init] * n, [solver] * n, [round_limit] * n,
+                                               [patience] * n, [target_conflicts] * n):
+                        self.applySolved(solved)
+        finally:
+            del assignment, colors
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+
+    def _shareSolverArrays(self):
+        # coordinates, visibility and assignment for the worker processes, in shared memory
+        # except for arrays a cache file still holds, which the workers map themselves
+        arrays = [('user_coords', self.user_coords), ('satellite_coords', self.satellite_coords), ('visible_indptr', self.visible_indptr),
+                  ('visible_indices', self.visible_indices), ('user_satellite', self.user_satellite), ('user_color', self.user_color)]
+        segments, specs = [], []
+        for name, array in arrays:
+            cached = self._cache_files.get(name)
+            if cached is not None and cached[0] is array:
+                specs.append(cached[1])
+            else:
+                segment, spec = _shareArray(array)
+                segments.append(segment)
+                specs.append(spec)
+        return segments, specs
+
+    def applySolved(self, solved):
+        # replace the connections of each satellite in the (satellite id, [(beam id, user id, color
+        # value)]) lists returned by the workers
+        for satellite_id, connections in solved:
+            satellite = self.satellites[satellite_id]
+            for conn in list(satellite.current_connections):
+                self.disconnect(satellite, conn)
+            for conn_id, user_id, color in connections:
+                self.connect(satellite, SatelliteConnection(satellite_id, conn_id, self.users[user_id], Colors(color)))
+
+    def runPortfolio(self, num_seeds, workers=None, patience=None, init='random', solver='minConflicts', time_limit=None, target_conflicts=0, refill=True):
+        # independent solves from scratch under num_seeds seeds drawn from self.rng, one per process,
+        # keeping the one that serves the most users; ties go to the earlier seed
+        seeds = [self.rng.randrange(2 ** 32) for _ in range(num_seeds)]
+        segments, specs = self._shareSolverArrays()
+        try:
+            with ProcessPoolExecutor(workers or num_seeds, initializer=_initSolverWorker, initargs=(specs,)) as executor:
+                n = len(seeds)
+                runs = list(executor.map(_runSeed, seeds, [patience] * n, [init] * n, [solver] * n, [time_limit] * n, [target_conflicts] * n, [refill] * n))
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+        # every satellite is in each run, so this replaces the whole assignment
+        best = max(runs, key=lambda solved: sum(len(connections) for _, connections in solved))
+        self.applySolved(best)
+        return [sum(len(connections) for _, connections in solved) for solved in runs]
+
+    def run(self, workers=None, stats=None, patience=None, init='random', solver='minConflicts', time_limit=None, target_conflicts=0, portfolio=None, refill=True):
+        # time_limit bounds the solver phase in seconds, max_steps is left to each solver's default;
+        # portfolio=K runs K seeds in parallel, over at most workers processes, and keeps the best
+        if portfolio is not None and portfolio > 1:
+            with _phase(stats, 'runPortfolio'):
+                served = self.runPortfolio(portfolio, workers, patience, init, solver, time_limit, target_conflicts, refill)
+            if stats is not None:
+                stats.portfolio_served = served
+        elif workers is not None and workers > 1:
+            with _phase(stats, 'runParallel'):
+                self.runParallel(None, workers, init, solver, time_limit, patience, target_conflicts)
+            # one global matching once every round is in
+            if refill:
+                with _phase(stats, 'refill'):
+                    added = self.refill()
+                if stats is not None:
+                    stats.refilled_connections += added
+        else:
+            self.solve(None, stats, patience, init, solver, time_limit, target_conflicts, refill)
+        return self.result(stats)
+
+class SolverStats:
+    # optional telemetry filled in by StarlinkManager.run/resolve
+    def __init__(self):
+        self.phase_seconds = {}
+        # conflicted connections left at the start of each min-conflicts sweep
+        self.sweep_conflicts = []
+        # satellites skipped in each sweep because they had no conflicts
+        self.sweep_skipped = []
+        self.dropped_connections = 0
+        # connections added back into freed beams by refill
+        self.refilled_connections = 0
+        # users served by each seed of a portfolio run
+        self.portfolio_served = []
+        self.served_users = 0
+        # users visible to at least one satellite, the most that can be served
+        self.coverable_users = 0
+        self.total_users = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def recordSweep(self, conflicts, skipped):
+        self.sweep_conflicts.append(conflicts)
+        self.sweep_skipped.append(skipped)
+
+    def recordCoverage(self, manager, result):
+        self.served_users = len(result)
+        visible = np.unique(manager.visible_indices)
+        self.coverable_users = int(manager.user_alive[visible].sum())
+        self.total_users = int(manager.user_alive.sum())
+
+    @property
+    def coverage(self):
+        return self.served_users / self.total_users if self.total_users else 0.0
+
+    def summary(self):
+        return {
+            'phase_seconds': dict(self.phase_seconds),
+            'sweeps': len(self.sweep_conflicts),
+            'sweep_conflicts': list(self.sweep_conflicts),
+            'sweep_skipped': list(self.sweep_skipped),
+            'dropped_connections': self.dropped_connections,
+            'refilled_connections': self.refilled_connections,
+            'portfolio_served': list(self.portfolio_served),
+            'served_users': self.served_users,
+            'coverable_users': self.coverable_users,
+            'total_users': self.total_users,
+            'coverage': self.coverage,
+        }
+
+def _resolveIndex(user_coords, index):
+    # the k-d tree query assumes every user is at the radius of the first one, the
+    # spherical cell index checks each user's own cone, 'auto' picks it when radii differ
+    if index == 'auto':
+        radii = np.linalg.norm(user_coords, axis=1)
+        return 'cells' if len(radii) and np.ptp(radii) > 1e-9 * radii.max() else 'kdtree'
+    if index not in ('kdtree', 'cells'):
+        raise ValueError(f"unknown index {index!r}, expected 'auto', 'kdtree' or 'cells'")
+    return index
+
+def _matchUsers(candidates):
+    # maximum matching of users to satellites with capacities, by augmenting paths; candidates
+    # maps satellite -> (user ids, capacity), returns satellite -> set of matched user ids
+    owner = {}
+    matched = {satellite: set() for satellite in candidates}
+    # users before the pointer are known to be taken, taken users are only ever moved
+    pointer = dict.fromkeys(candidates, 0)
+    for root, (users, capacity) in candidates.items():
+        while len(matched[root]) < capacity:
+            # fast path, a user nobody has yet
+            while pointer[root] < len(users) and users[pointer[root]] in owner:
+                pointer[root] += 1
+            if pointer[root] < len(users):
+                user = users[pointer[root]]
+                owner[user] = root
+                matched[root].add(user)
+                continue
+            # otherwise move a taken user along an alternating path: root takes a user from
+            # another satellite, which takes another user instead, until one takes a free user
+            visited = set()
+            stack, path = [(root, iter(users))], []
+            found = False
+            while stack and not found:
+                satellite, options = stack[-1]
+                for user in options:
+                    if user in visited:
+                        continue
+                    visited.add(user)
+                    path.append(user)
+                    if user not in owner:
+                        found = True
+                    else:
+                        stack.append((owner[user], iter(candidates[owner[user]][0])))
+                    break
+                else:
+                    stack.pop()
+                    if path:
+                        path.pop()
+            if not found:
+                break
+            for (satellite, _), user in zip(stack, path):
+                if user in owner:
+                    matched[owner[user]].discard(user)
+                owner[user] = satellite
+                matched[satellite].add(user)
+    return matched
+
+def _phase(stats, name):
+    return nullcontext() if stats is None else stats.phase(name)
+
+def _shareArray(array):
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+def _attachArray(spec):
+    if isinstance(spec, str):
+        return None, np.load(spec, mmap_mode='r')
+    name, shape, dtype = spec
+    segment = shared_memory.SharedMemory(name=name)
+    return segment, np.ndarray(shape, dtype, buffer=segment.buf)
+
+# per-process state of the parallel solver workers
+_solver_worker = None
+
+def _initSolverWorker(specs):
+    global _solver_worker
+    segments, arrays = zip(*(_attachArray(spec) for spec in specs))
+    user_coords, satellite_coords, indptr, indices, assignment, colors = arrays
+    manager = StarlinkManager(user_coords, satellite_coords, visibility=(indptr, indices))
+    _solver_worker = (segments, manager, (assignment, colors))
+
+def _collectSolved(manager, satellites):
+    # hand back the connections of the satellites and leave them empty for the next task
+    solved = []
+    for satellite in satellites:
+        solved.append((satellite.id, [(conn.conn_id, conn.user.id, conn.color.value) for conn in satellite.current_connections]))
+        for conn in list(satellite.current_connections):
+            manager.disconnect(satellite, conn)
+    return solved
+
+def _solveSatellites(satellite_ids, seed, max_steps, init, solver, time_limit, patience=None, target_conflicts=0):
+    # solve satellites that share no visible users against the assignment at the start of the round
+    _, manager, (assignment, colors) = _solver_worker
+    manager.rng.seed(seed)
+    manager.user_satellite[:] = assignment
+    manager.user_color[:] = colors
+    satellites = [manager.satellites[j] for j in satellite_ids]
+    # warm start from the beams the satellites already have, like a serial resolve
+    for satellite in satellites:
+        users = satellite.visible_users[assignment[satellite.visible_users] == satellite.id]
+        for conn_id, user_id in enumerate(users.tolist(), 1):
+            manager.connect(satellite, SatelliteConnection(satellite.id, conn_id, manager.users[user_id], Colors(int(colors[user_id]))))
+    manager.initialize(init, satellites)
+    manager.optimize(solver, max_steps, satellites, patience=patience, time_limit=time_limit, target_conflicts=target_conflicts)
+    manager.cleanUp(satellites)
+    return _collectSolved(manager, satellites)
+
+def _runSeed(seed, patience, init, solver, time_limit, target_conflicts, refill):
+    # one portfolio member, a full serial solve from scratch
+    _, manager, _ = _solver_worker
+    manager.rng.seed(seed)
+    manager.user_satellite[:] = -1
+    manager.user_color[:] = -1
+    manager.solve(None, None, patience, init, solver, time_limit, target_conflicts, refill)
+    return _collectSolved(manager, manager.satellites)
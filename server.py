@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bulk_io import loadCoordinates
+from satellite import Colors, StarlinkManager
+
+# seconds to wait after the first queued change for more to join the same solve
+BATCH_WINDOW = 0.005
+
+class AssignmentServer:
+    # serves newline-delimited JSON requests against a warm StarlinkManager:
+    #   {"op": "join", "coords": [[x, y, z], ...]}       -> {"users": [...], "assignments": [...]}
+    #   {"op": "leave", "users": [...]}                  -> {"removed": [...]}
+    #   {"op": "satellites", "ids": [...], "coords": [...]} -> {"moved": [...]}
+    #   {"op": "lookup", "users": [...]}                 -> {"assignments": [...]}
+    # an assignment is [satellite id, color name] or null, and any "id" in a request is echoed
+    # back. Changes queue up and are applied together, followed by one incremental solve, in
+    # a worker thread; lookups are answered at once from the last published assignment. When the
+    # solve fails the changes stay applied, and their responses carry a "solve_error" as well
+    def __init__(self, manager, window=BATCH_WINDOW, **solve_options):
+        self.manager = manager
+        self.window = window
+        self.solve_options = solve_options
+        self.batches = 0
+        self._pending = []
+        self._wakeup = None
+        self._batcher = None
+        self._executor = ThreadPoolExecutor(1)
+        self._writers = set()
+        self.server = None
+        self.published = (manager.user_satellite.copy(), manager.user_color.copy())
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        # a Unix socket when path is given, TCP otherwise; port 0 picks a free port
+        self._wakeup = asyncio.Event()
+        self._batcher = asyncio.create_task(self._batchLoop())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._handleConnection, path)
+        else:
+            self.server = await asyncio.start_server(self._handleConnection, host, port)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        self.server.close()
+        # clients see the end of the stream, so their handlers finish on their own
+        for writer in list(self._writers):
+            writer.transport.abort()
+        await self.server.wait_closed()
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+
+    def lookup(self, user_ids, published=None):
+        user_satellite, user_color = self.published if published is None else published
+        assignments = []
+        for user_id in user_ids:
+            if 0 <= user_id < len(user_satellite) and user_satellite[user_id] >= 0:
+                assignments.append([int(user_satellite[user_id]), Colors(int(user_color[user_id])).name])
+            else:
+                assignments.append(None)
+        return assignments
+
+    async def handle(self, request):
+        # the response to one request, as a dict
+        op = request.get('op')
+        if op == 'lookup':
+            return {'assignments': self.lookup([int(user_id) for user_id in request['users']])}
+        if op not in ('join', 'leave', 'satellites'):
+            raise ValueError(f"unknown op {op!r}, expected 'join', 'leave', 'satellites' or 'lookup'")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((request, future))
+        self._wakeup.set()
+        return await future
+
+    async def _handleConnection(self, reader, writer):
+        self._writers.add(writer)
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                request = None
+                try:
+                    request = json.loads(line)
+                    if request.get('op') == 'lookup':
+                        # answered inline, without a task per request
+                        self._write(writer, request, await self.handle(request))
+                        continue
+                except (ValueError, KeyError, TypeError, IndexError, AttributeError) as error:
+                    self._write(writer, request, {'error': str(error)})
+                    continue
+                task = asyncio.create_task(self._respond(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, request, writer):
+        try:
+            response = await self.handle(request)
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            response = {'error': str(error)}
+        self._write(writer, request, response)
+
+    def _write(self, writer, request, response):
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode() + b'\n')
+
+    async def _batchLoop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            try:
+                responses, self.published = await loop.run_in_executor(self._executor, self._applyBatch, [request for request, _ in batch])
+            except Exception as error:
+                # keep serving, the changes before the failure stay applied and are published
+                # one dict per request, _write adds each request's own id
+                responses = [{'error': f"batch failed: {error}"} for _ in batch]
+                self.published = (self.manager.user_satellite.copy(), self.manager.user_color.copy())
+            self.batches += 1
+            for (_, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    def _applyBatch(self, requests):
+        # runs in the worker thread: every change in arrival order, then one solve
+        manager = self.manager
+        responses, joined = [], []
+        for request in requests:
+            try:
+                if request['op'] == 'join':
+                    user_ids = manager.addUsers(np.asarray(request['coords'], dtype=np.float64).reshape(-1, 3))
+                    joined.append((len(responses), user_ids))
+                    responses.append({'users': user_ids.tolist()})
+                elif request['op'] == 'leave':
+                    user_ids = np.asarray(request['users'], dtype=np.int64)
+                    if len(user_ids) and (user_ids.min() < 0 or user_ids.max() >= len(manager.user_coords)):
+                        raise ValueError("unknown user id")
+                    responses.append({'removed': manager.removeUsers(user_ids).tolist()})
+                else:
+                    satellite_coords = manager.satellite_coords.copy()
+                    ids = request.get('ids', range(len(satellite_coords)))
+                    satellite_coords[np.asarray(ids, dtype=np.int64)] = np.asarray(request['coords'], dtype=np.float64).reshape(-1, 3)
+                    responses.append({'moved': manager.updateSatellites(satellite_coords).tolist()})
+            except (ValueError, KeyError, TypeError, IndexError) as error:
+                responses.append({'error': str(error)})
+        try:
+            manager.resolve(**self.solve_options)
+        except Exception as error:
+            # joined users keep their new ids and leaves stay gone, only the new assignment is missing
+            for response in responses:
+                if 'error' not in response:
+                    response['solve_error'] = str(error)
+        published = (manager.user_satellite.copy(), manager.user_color.copy())
+        for position, user_ids in joined:
+            responses[position]['assignments'] = self.lookup(user_ids.tolist(), published)
+        return responses, published
+
+async def serve(manager, host='127.0.0.1', port=0, path=None, window=BATCH_WINDOW, **solve_options):
+    server = AssignmentServer(manager, window, **solve_options)
+    await server.start(host, port, path)
+    print(f"serving on {server.address}", file=sys.stderr)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve beam assignments over newline-delimited JSON on a local socket.')
+    parser.add_argument('users', help='initial user coordinates, in any format bulk_io reads')
+    parser.add_argument('satellites', help='satellite coordinates')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW, help='seconds to coalesce changes into one solve')
+    parser.add_argument('--time-limit', type=float, help='wall-clock budget of each incremental solve in seconds')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--cache-dir', help='reuse the index and visibility cached in this directory')
+    args = parser.parse_args(argv)
+
+    user_coords, satellite_coords = loadCoordinates(args.users), loadCoordinates(args.satellites)
+    if args.cache_dir:
+        manager = StarlinkManager.cached(user_coords, satellite_coords, args.cache_dir, seed=args.seed)
+    else:
+        manager = StarlinkManager(user_coords, satellite_coords, seed=args.seed)
+    manager.run(time_limit=args.time_limit)
+    try:
+        asyncio.run(serve(manager, args.host, args.port, args.unix, args.window, time_limit=args.time_limit))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
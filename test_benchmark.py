@@ -0,0 +1,21 @@
+import unittest
+from benchmark import *
+
+class TestBenchmark(unittest.TestCase):
+    def test_runScenario(self):
+        entry = runScenario(2500, 10, seed=3)
+        self.assertEqual(entry['users'], 2500)
+        self.assertEqual(entry['satellites'], 10)
+        self.assertEqual(sorted(entry['phases']), sorted(PHASES))
+        for phase in PHASES:
+            self.assertGreaterEqual(entry['phases'][phase]['seconds'], 0)
+        self.assertGreater(entry['peak_memory_mb'], 0)
+        # the same seed gives the same scenario and solution
+        self.assertEqual(runScenario(2500, 10, seed=3)['served_users'], entry['served_users'])
+
+    def test_compareToBaseline(self):
+        def entry(seconds):
+            return {'users': 100, 'satellites': 10, 'phases': {phase: {'seconds': seconds} for phase in PHASES}}
+        self.assertEqual(compareToBaseline([entry(1.1)], [entry(1.0)], tolerance=0.25), [])
+        regressions = compareToBaseline([entry(2.0)], [entry(1.0)], tolerance=0.25)
+        self.assertEqual([r['phase'] for r in regressions], PHASES)
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from bulk_io import *
+from cli import main
+from test_utils import generateTestUsers, generateTestSatellites
+
+class TestBulkIO(unittest.TestCase):
+    def test_coordinate_formats(self):
+        coords = np.random.uniform(-1, 1, size=(1000, 3))
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {name: os.path.join(directory, name) for name in ['users.npy', 'users.bin', 'users.csv', 'users.txt']}
+            np.save(paths['users.npy'], coords)
+            coords.astype('<f8').tofile(paths['users.bin'])
+            np.savetxt(paths['users.csv'], coords, delimiter=',', header='x,y,z', comments='', fmt='%.17g')
+            with open(paths['users.txt'], 'w') as f:
+                f.write('# users\n')
+                for x, y, z in coords.tolist():
+                    f.write(f'{x!r} {y!r}  {z!r}\n')
+            for path in paths.values():
+                loaded = loadCoordinates(path, chunk_rows=64)
+                self.assertEqual(loaded.tolist(), coords.tolist())
+                chunks = list(iterCoordinates(path, chunk_rows=64))
+                if path.endswith(('.npy', '.bin')):
+                    self.assertEqual(max(len(chunk) for chunk in chunks), 64)
+                self.assertEqual(np.concatenate(chunks).tolist(), coords.tolist())
+            self.assertIsInstance(loadCoordinates(paths['users.npy']), np.memmap)
+
+            with open(paths['users.txt'], 'a') as f:
+                f.write('1.0 2.0 oops\n')
+            with self.assertRaises(ValueError):
+                loadCoordinates(paths['users.txt'])
+
+    def test_write_assignments(self):
+        user_satellite = np.array([-1, 3, 0, -1, 7, 3], dtype=np.int32)
+        user_color = np.array([-1, 2, 0, -1, 1, 3], dtype=np.int8)
+        expected = [[3, 1, 2], [0, 2, 0], [7, 4, 1], [3, 5, 3]]
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ['out.npy', 'out.bin', 'out.csv']:
+                path = os.path.join(directory, name)
+                self.assertEqual(writeAssignments(path, user_satellite, user_color, chunk_rows=4), 4)
+                self.assertEqual(readAssignments(path).tolist(), expected)
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as directory:
+            users, satellites = os.path.join(directory, 'users.npy'), os.path.join(directory, 'satellites.csv')
+            output, stats = os.path.join(directory, 'out.csv'), os.path.join(directory, 'stats.json')
+            np.save(users, np.array(generateTestUsers(60, 1)))
+            np.savetxt(satellites, np.array(generateTestSatellites(20, 1.08, 1.09)), delimiter=',')
+            self.assertEqual(main([users, satellites, output, '--seed', '3', '--stats', stats, '--cache-dir', directory]), 0)
+            rows = readAssignments(output)
+            self.assertGreater(len(rows), 0)
+            self.assertEqual(len(set(rows[:, 1].tolist())), len(rows))
+            self.assertTrue(os.path.exists(stats))
+
+    def test_core_imports_stay_light(self):
+        # the solver and the loaders must not pull in the debugger or plotting
+        code = 'import sys, satellite, bulk_io, cli; print(sorted(m for m in ("pdb", "matplotlib") if m in sys.modules))'
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.stdout.strip(), '[]')
+
+if __name__ == '__main__':
+    unittest.main()
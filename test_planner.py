@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+from planner import *
+from satellite import SolverStats, StarlinkManager
+from verify import verifyManager, verifySolution
+from test_utils import generateTestUsers
+
+class TestPlanner(unittest.TestCase):
+    def test_circular_orbits(self):
+        orbits = CircularOrbits(1 + 550 / EARTH_RADIUS_KM, [0, 53, 90], [0, 40, 80], [0, 10, 20], earth_fixed=False)
+        self.assertEqual(len(orbits), 3)
+        # about 95.6 minutes at 550 km
+        self.assertAlmostEqual(orbits.period[0] / 60, 95.6, delta=0.2)
+
+        times = np.linspace(0, orbits.period[0], 200)
+        positions = orbits.positions(times)
+        self.assertEqual(positions.shape, (200, 3, 3))
+        np.testing.assert_allclose(np.linalg.norm(positions, axis=2), orbits.radius[0])
+        np.testing.assert_allclose(positions[0, 0], [orbits.radius[0], 0, 0], atol=1e-12)
+        np.testing.assert_allclose(positions[-1], positions[0], atol=1e-9)
+        # the highest latitude reached is the inclination
+        latitudes = np.degrees(np.arcsin(positions[:, :, 2] / orbits.radius[0])).max(axis=0)
+        np.testing.assert_allclose(latitudes, [0, 53, 90], atol=1)
+
+        # in the earth-fixed frame the node drifts west with the earth's rotation
+        fixed = CircularOrbits(orbits.radius, orbits.inclination, orbits.raan, orbits.phase).positions(times)
+        np.testing.assert_allclose(fixed[0], positions[0])
+        self.assertLess(np.arctan2(fixed[-1, 0, 1], fixed[-1, 0, 0]), -0.4)
+
+    def test_pass_planner(self):
+        user_coords = np.array(generateTestUsers(40, 1))
+        raan = np.repeat(np.arange(8) * 45, 12)
+        phase = np.tile(np.arange(12) * 30, 8)
+        orbits = CircularOrbits(1 + 550 / EARTH_RADIUS_KM, 53, raan, phase)
+        planner = PassPlanner(user_coords, orbits, np.arange(6) * 60.0, seed=0)
+        self.assertEqual(len(planner), 6)
+
+        # the batched rows of each step match a fresh query at its positions
+        for step in range(6):
+            indptr, indices = planner.stepVisibility(step)
+            expected = StarlinkManager(user_coords, planner.positions[step]).visibility()
+            np.testing.assert_array_equal(indptr, expected[0])
+            np.testing.assert_array_equal(indices, expected[1])
+        # the manager starts from the first step's batched rows
+        for got, want in zip(planner.manager.visibility(), planner.stepVisibility(0)):
+            np.testing.assert_array_equal(got, want)
+
+        stats = SolverStats()
+        results = planner.plan(stats=stats, init='greedy')
+        self.assertEqual(len(results), 6)
+        self.assertIn('updateSatellites', stats.phase_seconds)
+        for step, result in enumerate(results):
+            self.assertGreater(len(result), 0)
+            self.assertTrue(verifySolution(user_coords, planner.positions[step], result)['valid'])
+        np.testing.assert_array_equal(planner.manager.satellite_coords, planner.positions[-1])
+        np.testing.assert_array_equal(planner.positions, orbits.positions(planner.times))
+
+        # planning again starts over from the first step
+        results = planner.plan(init='greedy')
+        for step, result in enumerate(results):
+            self.assertTrue(verifySolution(user_coords, planner.positions[step], result)['valid'])
+        self.assertEqual(len(results[0]), len(StarlinkManager(user_coords, planner.positions[0]).run(init='greedy')))
+        self.assertTrue(verifyManager(planner.manager)['valid'])
+
+        with self.assertRaises(ValueError):
+            PassPlanner(user_coords, orbits, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,29 +1,37 @@
+import os
+import tempfile
 import unittest
-import cProfile
-from pstats import Stats
+from unittest import mock
 import numpy as np
-import pdb
+import satellite as satellite_module
 from satellite import *
+from satellite import _initSolverWorker, _matchUsers, _solveSatellites
 from test_utils import *
+from verify import verifyManager
 
 class TestSatellite(unittest.TestCase):
-    def setUp(self):
-        self.pr = cProfile.Profile()
-        self.pr.enable()
-
-    def tearDown(self):
-        p = Stats(self.pr)
-        p.strip_dirs()
-        p.sort_stats('cumtime')
-        p.print_stats()
-        print("\n--->>>")
+    def assertValid(self, manager):
+        # the placement rules as the verifier checks them, and beams that agree with the assignment arrays
+        report = verifyManager(manager)
+        self.assertTrue(report['valid'], report['violations'])
+        beams = [(satellite.id, conn.user.id, conn.conn_id) for satellite in manager.satellites for conn in satellite.current_connections]
+        self.assertEqual(len(beams), report['beams'])
+        self.assertEqual(len(beams), len({(satellite_id, conn_id) for satellite_id, _, conn_id in beams}))
+        for satellite_id, user_id, _ in beams:
+            self.assertEqual(manager.user_satellite[user_id], satellite_id)
 
     def test_build_kdtree(self):
         points = [(1, 2, 3), (4, 5, 6), (7, 8, 9)]
-        kdtree = KDTree(points)
-        self.assertEqual(kdtree.root.point, (4, 5, 6))
-        self.assertEqual(kdtree.root.left.point, (1, 2, 3))
-        self.assertEqual(kdtree.root.right.point, (7, 8, 9))
+        kdtree = KDTree(points, leaf_size=1)
+        root = kdtree.root
+        left, right = kdtree.left[root], kdtree.right[root]
+        self.assertEqual(kdtree.axis[root], 0)
+        self.assertEqual(kdtree.split[root], 4)
+        self.assertEqual(kdtree.points[kdtree.indices[kdtree.start[left]:kdtree.end[left]]].tolist(), [[1, 2, 3]])
+        self.assertEqual(kdtree.axis[right], 1)
+        self.assertEqual(kdtree.split[right], 8)
+        self.assertEqual(kdtree.points[kdtree.indices[kdtree.start[kdtree.left[right]]]].tolist(), [4, 5, 6])
+        self.assertEqual(kdtree.points[kdtree.indices[kdtree.start[kdtree.right[right]]]].tolist(), [7, 8, 9])
 
     def test_ball_query_kdtree(self):
         points = [(1, 2, 3), (4, 5, 6), (7, 8, 9)]
@@ -57,8 +65,64 @@ class TestSatellite(unittest.TestCase):
                     # print("AssertNotIn passed")
 
 
+    def test_ball_query_batch_kdtree(self):
+        points = np.random.uniform(-100, 100, size=(2000, 3))
+        kdtree = KDTree(points, leaf_size=8)
+        centers = np.random.uniform(-100, 100, size=(20, 3))
+        radii = np.random.uniform(1, 100, size=20)
+        results = kdtree.ball_query_batch(centers, radii)
+        self.assertEqual(len(results), 20)
+        for center, r, result in zip(centers, radii, results):
+            expected = np.nonzero(np.linalg.norm(points - center, axis=1) <= r)[0]
+            self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_kdforest_insert_delete(self):
+        points = np.random.uniform(-100, 100, size=(300, 3))
+        forest = KDForest(points[:100], leaf_size=8)
+        for start in range(100, 300, 20):
+            ids = forest.insert(points[start:start + 20])
+            self.assertEqual(ids.tolist(), list(range(start, start + 20)))
+        deleted = np.random.choice(300, 200, replace=False)
+        forest.delete(deleted[:50])
+        forest.delete(deleted[50:])
+        self.assertEqual(len(forest), 100)
+        alive = np.ones(300, dtype=bool)
+        alive[deleted] = False
+
+        centers = np.random.uniform(-100, 100, size=(10, 3))
+        for center, result in zip(centers, forest.ball_query_batch(centers, 60)):
+            expected = np.nonzero((np.linalg.norm(points - center, axis=1) <= 60) & alive)[0]
+            self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_sphere_cell_index(self):
+        # users at varying altitudes, including some right at the poles
+        users = np.array(generateTestUsers(40, 1)) * np.random.uniform(1.0, 1.01, size=(1600, 1))
+        users[:2] = [[0, 0, 1.005], [0, 0, -1.0]]
+        satellites = np.array(generateTestSatellites(30, 1.05, 1.09))
+        satellites[0] = [0, 0, 1.07]
+        index = SphereCellIndex(users[:1000], cell_degrees=2.0)
+        self.assertEqual(index.insert(users[1000:]).tolist(), list(range(1000, 1600)))
+        index.delete(range(0, 1600, 7))
+        alive = np.ones(len(users), dtype=bool)
+        alive[::7] = False
+
+        indptr, indices = index.cone_query_csr(satellites)
+        for j, satellite in enumerate(satellites):
+            expected = np.nonzero(withinUserCone(users, np.broadcast_to(satellite, users.shape)) & alive)[0]
+            self.assertEqual(indices[indptr[j]:indptr[j + 1]].tolist(), expected.tolist())
+        self.assertGreater(indptr[1] - indptr[0], 0)
+
+        # cell sizes that do not divide 360 degrees, with caps across the antimeridian
+        users, satellites = (np.array(coords) for coords in generateTestScenario(100, 200, seed=3))
+        satellites[:20] = [[-1.08 * math.cos(lat), 0.01 * k, 1.08 * math.sin(lat)] for k, lat in enumerate(np.linspace(-1.4, 1.4, 20))]
+        for cell_degrees in [7.0, 13.0]:
+            indptr, indices = SphereCellIndex(users, cell_degrees=cell_degrees).cone_query_csr(satellites)
+            for j, satellite in enumerate(satellites):
+                expected = np.nonzero(withinUserCone(users, np.broadcast_to(satellite, users.shape)))[0]
+                self.assertEqual(indices[indptr[j]:indptr[j + 1]].tolist(), expected.tolist())
+
     def test_angle_between(self):
-        satellite = Satellite(0, 0, 0, 0, set())
+        satellite = Satellite(0, 0, 0, 0, [])
         user1 = User(1, 1, 0, 0)
         user2 = User(2, 0, 1, 0)
         connection1 = SatelliteConnection(0, 0, user1, Colors.Blue)
@@ -67,10 +131,17 @@ class TestSatellite(unittest.TestCase):
         self.assertAlmostEqual(angle, 90.0, delta=0.001)
         print("Test angle between passed")
 
+    def test_beamDirections(self):
+        # users at 0, 4 and 15 degrees as seen from the satellite
+        users = [User(i, 2 * math.cos(math.radians(a)), 2 * math.sin(math.radians(a)), 0) for i, a in enumerate([0, 4, 15])]
+        sat = Satellite(0, 0, 0, 0, [0, 1, 2], users)
+        self.assertTrue(np.allclose(sat.beamDirections()[2], [math.cos(math.radians(15)), math.sin(math.radians(15)), 0]))
+        self.assertTrue(np.allclose(np.linalg.norm(sat.beamDirections(), axis=1), 1))
+
     def test_remove_no_connections(self):
         user1 = User(1, 1, 1, 1)
         user2 = User(2, 2, 2, 2)
-        sat = Satellite(1, 0, 0, 0, {user1, user2})
+        sat = Satellite(1, 0, 0, 0, [1, 2])
         conn1 = SatelliteConnection(1, 1, user1, Colors.Blue)
         conn2 = SatelliteConnection(1, 2, user2, Colors.Green)
         sat.current_connections = {conn1, conn2}
@@ -81,7 +152,7 @@ class TestSatellite(unittest.TestCase):
         user1 = User(1, 1, 1, 1)
         user2 = User(2, 2, 2, 2)
         user3 = User(3, 3, 3, 3)
-        sat = Satellite(1, 0, 0, 0, {user1, user2, user3})
+        sat = Satellite(1, 0, 0, 0, [1, 2, 3])
         conn1 = SatelliteConnection(1, 1, user1, Colors.Blue)
         conn2 = SatelliteConnection(1, 2, user2, Colors.Blue)
         conn3 = SatelliteConnection(1, 3, user3, Colors.Blue)
@@ -91,12 +162,12 @@ class TestSatellite(unittest.TestCase):
 
     def test_find_random_conflicted_connection(self):
         # Create a satellite
-        sat = Satellite(0, 0, 0, 0, set())
+        sat = Satellite(0, 0, 0, 0, [])
         
         # Add a user
         user1 = User(1, 1, 0, 0)
-        user2 = User(1, 0.996, 0.087, 0)
-        user3 = User(1, 0.966, 0.2588, 0)
+        user2 = User(2, 0.996, 0.087, 0)
+        user3 = User(3, 0.966, 0.2588, 0)
         sat.addUser(user1)
         
         # Add two connections with same color and an angle of 5 degrees
@@ -125,6 +196,28 @@ class TestSatellite(unittest.TestCase):
         res = sat.findRandomConflictedConnection()
         self.assertEqual(res, None)
 
+    def test_incremental_conflict_counts(self):
+        user1 = User(1, 1, 0, 0)
+        user2 = User(2, 0.996, 0.087, 0)
+        user3 = User(3, 0.999, -0.044, 0)
+        sat = Satellite(0, 0, 0, 0, [])
+        conn1 = SatelliteConnection(0, 1, user1, Colors.Blue)
+        conn2 = SatelliteConnection(0, 2, user2, Colors.Blue)
+        conn3 = SatelliteConnection(0, 3, user3, Colors.Blue)
+        sat.addConnection(conn1)
+        self.assertEqual(sat.numConflictedConnections(), 0)
+        sat.addConnection(conn2)
+        sat.addConnection(conn3)
+        self.assertEqual(sat.numConflictedConnections(), 3)
+        self.assertEqual(sat.getNumConflictingConnections(conn1), 2)
+
+        sat.removeConnection(conn1)
+        self.assertEqual(sat.getNumConflictingConnections(conn2), 1)
+        sat.removeConnection(conn2)
+        self.assertEqual(sat.getNumConflictingConnections(conn3), 0)
+        self.assertEqual(sat.numConflictedConnections(), 0)
+        self.assertEqual(sat.findRandomConflictedConnection(), None)
+
     def test_getAlternativeMinConflictConnection(self):
         # create a satellite with some visible and current connections
         user1 = User(1, 1, 1, 1)
@@ -132,26 +225,40 @@ class TestSatellite(unittest.TestCase):
         user3 = User(3, 3, 3, 3)
         user4 = User(4, 4, 4, 4)
         user5 = User(5, -5, -5, -5)
-        sat = Satellite(id=0, x=0, y=0, z=0, visible_users={user1, user2, user3, user4, user5})
+        users = [None, user1, user2, user3, user4, user5]
+        sat = Satellite(id=0, x=0, y=0, z=0, visible_users=[1, 2, 3, 4, 5], users=users)
         sat.addConnection(SatelliteConnection(0, 1, user1, Colors.Blue))
         sat.addConnection(SatelliteConnection(0, 2, user2, Colors.Green))
         sat.addConnection(SatelliteConnection(0, 3, user3, Colors.Red))
 
         # No unassigned users
-        unassigned_users = set()
+        user_satellite = np.zeros(len(users), dtype=np.int32)
 
         # test on a conflict with Blue, Red, and Green connections
         conflict_connection = SatelliteConnection(0, 4, user4, Colors.Red)
-        alt_conn = sat.getAlternativeMinConflictConnection(conflict_connection, unassigned_users)
+        alt_conn = sat.getAlternativeMinConflictConnection(conflict_connection, user_satellite)
         self.assertEqual(alt_conn.color, Colors.Yellow)
 
         # add colors full for the (1,1,1) direction but another user available in the opposite direction
         sat.addConnection(SatelliteConnection(0, 4, user4, Colors.Yellow))
-        unassigned_users.add(user5)
+        user_satellite[user5.id] = -1
         conflict_connection = SatelliteConnection(0, 4, user4, Colors.Red) # conflict along same direction
-        alt_conn = sat.getAlternativeMinConflictConnection(conflict_connection, unassigned_users)
+        alt_conn = sat.getAlternativeMinConflictConnection(conflict_connection, user_satellite)
         self.assertEqual(alt_conn.user.id, 5)
 
+    def test_getAlternativeMinConflictConnection_is_minimal(self):
+        user_coords = generateTestUsers(60, 1)
+        satellite_coords = generateTestSatellites(5, 1.08, 1.09)
+        manager = StarlinkManager(user_coords, satellite_coords)
+        manager.randomInit()
+        for satellite in manager.satellites:
+            for conflict_connection in list(satellite.current_connections)[:5]:
+                alt_conn = satellite.getAlternativeMinConflictConnection(conflict_connection, manager.user_satellite)
+                candidates = [conflict_connection.user] + [manager.users[i] for i in satellite.unassignedVisibleUsers(manager.user_satellite).tolist()]
+                best = min(satellite.getNumConflictingConnections(SatelliteConnection(satellite.id, 0, user, color)) for user in candidates for color in Colors)
+                self.assertIn(alt_conn.user, candidates)
+                self.assertEqual(satellite.getNumConflictingConnections(alt_conn), best)
+
     def test_getNumConflictingConnections(self):
         # create some users
         user1 = User(1, 0, 0, 0)
@@ -168,7 +275,7 @@ class TestSatellite(unittest.TestCase):
         conn5 = SatelliteConnection(1, 5, user5, Colors.Yellow)
 
         # create a satellite with connections
-        sat = Satellite(1, 0, 0, 0, {user1, user2, user3, user4, user5})
+        sat = Satellite(1, 0, 0, 0, [1, 2, 3, 4, 5])
         sat.addConnection(conn1)
         sat.addConnection(conn2)
         sat.addConnection(conn3)
@@ -200,8 +307,8 @@ class TestSatellite(unittest.TestCase):
         eligible_user = manager.users[0]
         non_eligible_user = manager.users[1]
         eligible_users = manager.findSatelliteEligibleUsers(satellite)
-        assert eligible_user in eligible_users
-        assert non_eligible_user not in eligible_users
+        assert eligible_user.id in eligible_users
+        assert non_eligible_user.id not in eligible_users
 
         # Test Case 2: Multiple users, some eligible
         user_coords = generateTestUsers(100, 100)
@@ -209,14 +316,15 @@ class TestSatellite(unittest.TestCase):
         manager = StarlinkManager(user_coords, satellite_coords)
         satellite = manager.satellites[0]
         eligible_users = manager.findSatelliteEligibleUsers(satellite)
-        for user in eligible_users:
-            user_normal_vector = user_coords[manager.users.index(user)]
+        for user_id in eligible_users.tolist():
+            user = manager.users[user_id]
+            user_normal_vector = user_coords[user_id]
             user_to_sat_vector = (satellite.x - user.x, satellite.y - user.y, satellite.z - user.z)
             user_angle = angle_between_vectors(user_normal_vector, user_to_sat_vector)
             assert user_angle <= math.pi/4
 
-        non_eligible_users = set(manager.users) - set(eligible_users)
-        for user in non_eligible_users:
+        non_eligible_users = set(range(len(manager.users))) - set(eligible_users.tolist())
+        for user in (manager.users[i] for i in non_eligible_users):
             user_normal_vector = (user.x, user.y, user.z)
             user_to_sat_vector = (satellite.x - user.x, satellite.y - user.y, satellite.z - user.z)
             user_angle = angle_between_vectors(user_normal_vector, user_to_sat_vector)
@@ -254,4 +362,315 @@ class TestSatellite(unittest.TestCase):
         users = [connection.user for connection in connections]
         assert len(set(users)) == len(users), "Two connections connected to the same user"
 
+        # Test 5: The assignment arrays agree with the connection objects
+        assert (manager.user_satellite >= 0).sum() == num_satellites * 32
+        for satellite in manager.satellites:
+            for connection in satellite.current_connections:
+                assert manager.user_satellite[connection.user.id] == satellite.id
+                assert manager.user_color[connection.user.id] == connection.color.value
+
+    def test_duplicate_user_coordinates(self):
+        # users sharing a location stay distinct
+        user_coords = [(1, 1, 1), (1, 1, 1), (-1, -1, -1)]
+        manager = StarlinkManager(user_coords, [(2, 2, 2)])
+        self.assertEqual(manager.satellites[0].visible_users.tolist(), [0, 1])
+        manager.randomInit()
+        self.assertEqual(sorted(manager.generateResult()), [(0, 0), (0, 1)])
+
+
+    def test_satelliteRounds(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        rounds = manager.satelliteRounds()
+        self.assertEqual(sorted(j for r in rounds for j in r), list(range(40)))
+        for satellite_ids in rounds:
+            seen = [user_id for j in satellite_ids for user_id in manager.satellites[j].visible_users.tolist()]
+            self.assertEqual(len(seen), len(set(seen)))
+
+    def test_run_parallel(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        result = manager.run(workers=2)
+        self.assertValid(manager)
+        self.assertEqual(len(result), np.count_nonzero(manager.user_satellite >= 0))
+
+        # a second parallel run warm-starts from the beams in place instead of adding to them
+        served = len(result)
+        result = manager.run(workers=2)
+        self.assertGreaterEqual(len(result), served)
+        self.assertEqual(len(result), np.count_nonzero(manager.user_satellite >= 0))
+        self.assertValid(manager)
+
+    def test_parallel_solver_options(self):
+        # the workers hand patience and target_conflicts on to the solver
+        manager = StarlinkManager(generateTestUsers(30, 1), generateTestSatellites(10, 1.08, 1.09))
+        segments, specs = manager._shareSolverArrays()
+        try:
+            _initSolverWorker(specs)
+            with mock.patch.object(StarlinkManager, 'optimize') as optimize:
+                _solveSatellites([0, 1], 0, None, 'random', 'minConflicts', None, 3, 5)
+            self.assertEqual(optimize.call_args.kwargs['patience'], 3)
+            self.assertEqual(optimize.call_args.kwargs['target_conflicts'], 5)
+        finally:
+            for segment in satellite_module._solver_worker[0] + tuple(segments):
+                if segment is not None:
+                    segment.close()
+            for segment in segments:
+                segment.unlink()
+            satellite_module._solver_worker = None
+
+    def test_updateSatellites_resolve(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        manager.run()
+        before = {sat.id: {conn.user.id for conn in sat.current_connections} for sat in manager.satellites}
+
+        # move the first ten satellites
+        new_coords = np.array(satellite_coords)
+        new_coords[:10] = generateTestSatellites(10, 1.08, 1.09)
+        moved = manager.updateSatellites(new_coords)
+        self.assertEqual(moved.tolist(), list(range(10)))
+        for j in moved.tolist():
+            expected = manager.findSatelliteEligibleUsers(manager.satellites[j])
+            self.assertEqual(manager.satellites[j].visible_users.tolist(), expected.tolist())
+            for conn in manager.satellites[j].current_connections:
+                self.assertIn(conn.user.id, expected)
+        # connections of the satellites that did not move are kept
+        for sat in manager.satellites[10:]:
+            self.assertTrue(before[sat.id] <= {conn.user.id for conn in sat.current_connections})
+
+        result = manager.resolve()
+        users = [user_id for _, user_id in result]
+        self.assertEqual(len(users), len(set(users)))
+        for satellite_id, user_id in result:
+            self.assertIn(user_id, manager.satellites[satellite_id].visible_users)
+            self.assertEqual(manager.user_satellite[user_id], satellite_id)
+        self.assertEqual(int((manager.user_satellite >= 0).sum()), len(result))
+        for sat in manager.satellites:
+            self.assertEqual(sat.numConflictedConnections(), 0)
+
+        # the caller's coordinates are left alone, and read-only ones such as mapped files work
+        original = np.array(satellite_coords)
+        original.setflags(write=False)
+        manager = StarlinkManager(user_coords, original)
+        manager.updateSatellites(new_coords)
+        self.assertEqual(original.tolist(), np.array(satellite_coords).tolist())
+        self.assertEqual(manager.satellite_coords.tolist(), new_coords.tolist())
+
+    def test_addUsers_removeUsers(self):
+        user_coords = generateTestUsers(60, 1)
+        satellite_coords = generateTestSatellites(20, 1.08, 1.09)
+        manager = StarlinkManager(user_coords, satellite_coords)
+        manager.run()
+
+        new_ids = manager.addUsers(generateTestUsers(30, 1))
+        self.assertEqual(new_ids.tolist(), list(range(len(user_coords), len(user_coords) + 900)))
+        removed = manager.removeUsers([user_id for _, user_id in manager.generateResult()[:50]] + list(range(100)))
+        self.assertFalse(manager.user_alive[removed].any())
+
+        # visibility matches a fresh query over the live users
+        alive = np.nonzero(manager.user_alive)[0]
+        fresh = StarlinkManager(manager.user_coords[alive], satellite_coords)
+        for satellite, expected in zip(manager.satellites, fresh.satellites):
+            self.assertEqual(satellite.visible_users.tolist(), alive[expected.visible_users].tolist())
+            self.assertEqual(manager.findSatelliteEligibleUsers(satellite).tolist(), satellite.visible_users.tolist())
+        self.assertEqual(manager.visible_indptr[-1], len(manager.visible_indices))
+
+        result = manager.resolve()
+        users = [user_id for _, user_id in result]
+        self.assertEqual(len(users), len(set(users)))
+        self.assertTrue(manager.user_alive[users].all())
+        for satellite_id, user_id in result:
+            self.assertIn(user_id, manager.satellites[satellite_id].visible_users)
+
+    def test_mixed_altitude_users(self):
+        user_coords = np.array(generateTestUsers(40, 1)) * np.random.uniform(1.0, 1.01, size=(1600, 1))
+        satellite_coords = np.array(generateTestSatellites(30, 1.05, 1.09))
+        manager = StarlinkManager(user_coords, satellite_coords)
+        self.assertEqual(manager.index, 'cells')
+        for satellite, coords in zip(manager.satellites, satellite_coords):
+            expected = np.nonzero(withinUserCone(user_coords, np.broadcast_to(coords, user_coords.shape)))[0]
+            self.assertEqual(satellite.visible_users.tolist(), expected.tolist())
+
+        # a single new user, lower than any before, is found through its cell
+        new_id = manager.addUsers(satellite_coords[3] / np.linalg.norm(satellite_coords[3]) * 0.999)[0]
+        expected = np.nonzero(withinUserCone(np.broadcast_to(manager.user_coords[new_id], satellite_coords.shape), satellite_coords))[0]
+        self.assertIn(3, expected)
+        for j, satellite in enumerate(manager.satellites):
+            self.assertEqual(new_id in satellite.visible_users, j in expected)
+        result = manager.resolve()
+        for satellite_id, user_id in result:
+            self.assertIn(user_id, manager.satellites[satellite_id].visible_users)
+
+        # users at one radius keep the k-d tree until one at another altitude joins
+        manager = StarlinkManager(generateTestUsers(30, 1), satellite_coords)
+        self.assertEqual(manager.index, 'kdtree')
+        manager.addUsers([[0, 0, 1.002]])
+        self.assertEqual(manager.index, 'cells')
+        with self.assertRaises(ValueError):
+            StarlinkManager(user_coords, satellite_coords, index='geohash')
+
+    def test_cached_manager(self):
+        user_coords = generateTestUsers(60, 1)
+        satellite_coords = generateTestSatellites(20, 1.08, 1.09)
+        mixed_coords = np.array(user_coords) * np.random.uniform(1.0, 1.01, size=(3600, 1))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for coords in (user_coords, mixed_coords):
+                built = StarlinkManager.cached(coords, satellite_coords, cache_dir)
+                loaded = StarlinkManager.cached(coords, satellite_coords, cache_dir)
+                self.assertIsInstance(loaded.visible_indices, np.memmap)
+                self.assertEqual(loaded.index, built.index)
+                self.assertEqual(loaded.visible_indptr.tolist(), built.visible_indptr.tolist())
+                self.assertEqual(loaded.visible_indices.tolist(), built.visible_indices.tolist())
+
+                # the mapped index answers queries and takes churn like a freshly built one
+                loaded.addUsers(np.array(coords[:5]) * 1.0001)
+                loaded.removeUsers(range(10))
+                for satellite in loaded.satellites:
+                    self.assertEqual(loaded.findSatelliteEligibleUsers(satellite).tolist(), satellite.visible_users.tolist())
+                with self.assertRaises(ValueError):
+                    loaded.saveCache(cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            # workers map the cached visibility instead of copying it
+            manager = StarlinkManager.cached(user_coords, satellite_coords, cache_dir)
+            result = manager.run(workers=2)
+            for satellite_id, user_id in result:
+                self.assertIn(user_id, manager.satellites[satellite_id].visible_users)
+
+    def test_run_stats(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        stats = SolverStats()
+        result = manager.run(stats=stats)
+        self.assertEqual(set(stats.phase_seconds), {'randomInit', 'minConflicts', 'cleanUp', 'refill', 'generateResult'})
+        self.assertEqual(len(stats.sweep_conflicts), len(stats.sweep_skipped))
+        self.assertGreater(len(stats.sweep_conflicts), 0)
+        self.assertTrue(all(0 <= skipped <= 40 for skipped in stats.sweep_skipped))
+        self.assertEqual(stats.served_users, len(result))
+        self.assertEqual(stats.total_users, len(user_coords))
+        self.assertLessEqual(stats.served_users, stats.coverable_users)
+        self.assertAlmostEqual(stats.coverage, len(result) / len(user_coords))
+
+    def test_minConflicts_patience(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        manager.randomInit()
+        stats = SolverStats()
+        manager.minConflicts(1000, stats=stats, patience=3)
+        # stops either conflict free or after three sweeps without improvement
+        conflicts = stats.sweep_conflicts
+        self.assertTrue(conflicts[-1] == 0 or len(conflicts) >= 4 and min(conflicts[-3:]) >= min(conflicts[:-3]))
+
+    def test_greedyInit(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        manager.greedyInit()
+        # the start is conflict free, within 32 beams and serves each user at most once
+        self.assertValid(manager)
+
+        stats = SolverStats()
+        result = StarlinkManager(user_coords, satellite_coords).run(stats=stats, init='greedy')
+        self.assertIn('greedyInit', stats.phase_seconds)
+        self.assertEqual(stats.dropped_connections, 0)
+        with self.assertRaises(ValueError):
+            manager.run(init='fastest')
+
+    def test_coarseInit(self):
+        # a dense cluster, with many users per coarse cell, under satellites around it
+        rng = np.random.default_rng(0)
+        user_coords = np.array([0, 0, 1]) + rng.normal(scale=0.03, size=(3000, 3))
+        user_coords /= np.linalg.norm(user_coords, axis=1, keepdims=True)
+        satellite_coords = np.array([0, 0, 1]) + rng.normal(scale=0.1, size=(30, 3))
+        satellite_coords *= 1.085 / np.linalg.norm(satellite_coords, axis=1, keepdims=True)
+        manager = StarlinkManager(user_coords, satellite_coords, seed=0)
+        # a warm start keeps its beams and only fills the free ones
+        manager.randomInit(manager.satellites[:1])
+        manager.cleanUp()
+        kept = list(manager.satellites[0].current_connections)[:5]
+        for conn in list(manager.satellites[0].current_connections):
+            if conn not in kept:
+                manager.disconnect(manager.satellites[0], conn)
+        manager.coarseInit()
+        self.assertValid(manager)
+        self.assertTrue(set(kept) <= set(manager.satellites[0].current_connections))
+
+        # coverage close to the greedy start on every user
+        stats = SolverStats()
+        coarse = StarlinkManager(user_coords, satellite_coords, seed=0).run(stats=stats, init='coarse')
+        greedy = StarlinkManager(user_coords, satellite_coords, seed=0).run(init='greedy')
+        self.assertIn('coarseInit', stats.phase_seconds)
+        self.assertGreaterEqual(len(coarse), 0.9 * len(greedy))
+
+    def test_anneal(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords)
+        manager.randomInit()
+        stats = SolverStats()
+        manager.anneal(2000, stats=stats)
+        # the state left behind is the best seen and agrees with the assignment arrays
+        conflicts = sum(satellite.numConflictedConnections() for satellite in manager.satellites)
+        self.assertEqual(conflicts, stats.sweep_conflicts[-1])
+        self.assertLessEqual(conflicts, min(stats.sweep_conflicts))
+        for satellite in manager.satellites:
+            for conn in satellite.current_connections:
+                self.assertEqual(manager.user_satellite[conn.user.id], satellite.id)
+                self.assertEqual(manager.user_color[conn.user.id], conn.color.value)
+
+        # snapshot and restore round trip
+        snapshot = manager.snapshot()
+        manager.anneal(200, start_temperature=100.0, end_temperature=100.0)
+        manager.restore(snapshot)
+        self.assertEqual(sum(satellite.numConflictedConnections() for satellite in manager.satellites), conflicts)
+
+        # a time budget bounds the solver phase
+        stats = SolverStats()
+        result = StarlinkManager(user_coords, satellite_coords).run(stats=stats, solver='anneal', time_limit=0.2)
+        self.assertLess(stats.phase_seconds['anneal'], 1.0)
+        self.assertEqual(stats.served_users, len(result))
+        with self.assertRaises(ValueError):
+            manager.run(solver='tabu')
+
+    def test_refill(self):
+        # a greedy pass would give user 1 to satellite 'a' and leave 'b' empty
+        self.assertEqual(_matchUsers({'a': ([1, 2], 1), 'b': ([1], 1)}), {'a': {2}, 'b': {1}})
+        candidates = {'a': ([1, 2, 3, 4], 2), 'b': ([1, 2], 1), 'c': ([2, 5], 2), 'd': ([5], 1)}
+        matching = _matchUsers(candidates)
+        self.assertEqual(sum(len(users) for users in matching.values()), 5)
+        for satellite, users in matching.items():
+            self.assertLessEqual(len(users), candidates[satellite][1])
+            self.assertTrue(users <= set(candidates[satellite][0]))
+
+        # a seeded scenario, so that one sweep always leaves conflicts for cleanUp to drop
+        user_coords, satellite_coords = generateTestScenario(seed=2)
+        manager = StarlinkManager(user_coords, satellite_coords, seed=2)
+        manager.randomInit()
+        manager.minConflicts(1)
+        dropped = manager.cleanUp()
+        served = len(manager.generateResult())
+        added = manager.refill()
+        self.assertGreater(dropped, 0)
+        self.assertGreater(added, 0)
+        result = manager.generateResult()
+        self.assertEqual(len(result), served + added)
+        # still conflict free, within 32 distinct beams, and each user served once
+        self.assertValid(manager)
+        self.assertEqual(manager.refill(), 0)
+
+    def test_seeded_runs_repeat(self):
+        user_coords, satellite_coords = generateTestScenario()
+        results = [sorted(StarlinkManager(user_coords, satellite_coords, seed=5).run(solver=solver)) for solver in ['minConflicts', 'minConflicts', 'anneal', 'anneal']]
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[2], results[3])
 
+    def test_run_portfolio(self):
+        user_coords, satellite_coords = generateTestScenario()
+        manager = StarlinkManager(user_coords, satellite_coords, seed=1)
+        stats = SolverStats()
+        result = manager.run(stats=stats, portfolio=3, workers=2)
+        self.assertIn('runPortfolio', stats.phase_seconds)
+        self.assertEqual(len(stats.portfolio_served), 3)
+        self.assertEqual(len(result), max(stats.portfolio_served))
+        # the winning assignment is installed in the manager
+        self.assertEqual(sorted(result), sorted(manager.generateResult()))
+        self.assertValid(manager)
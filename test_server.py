@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from bulk_io import loadCoordinates
+from satellite import StarlinkManager
+from server import *
+from test_utils import generateTestUsers, generateTestSatellites
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.satellite_coords = np.array(generateTestSatellites(20, 1.08, 1.09))
+        self.manager = StarlinkManager(generateTestUsers(40, 1), self.satellite_coords, seed=0)
+        self.manager.run()
+        self.server = AssignmentServer(self.manager, window=0.05)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def request(self, reader, writer, request):
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    async def test_requests(self):
+        await self.server.start()
+        reader, writer = await asyncio.open_connection(*self.server.address[:2])
+
+        served = [user_id for _, user_id in self.manager.generateResult()][:3]
+        response = await self.request(reader, writer, {'op': 'lookup', 'users': served + [10 ** 9], 'id': 7})
+        self.assertEqual(response['id'], 7)
+        self.assertEqual([assignment[0] for assignment in response['assignments'][:3]], self.manager.user_satellite[served].tolist())
+        self.assertIsNone(response['assignments'][3])
+
+        # a user right under a satellite joins and is served after the batch solve
+        coords = self.satellite_coords[0] / np.linalg.norm(self.satellite_coords[0])
+        response = await self.request(reader, writer, {'op': 'join', 'coords': [coords.tolist()]})
+        new_id = response['users'][0]
+        self.assertEqual(new_id, 1600)
+        self.assertIn(new_id, self.manager.satellites[0].visible_users)
+        lookup = await self.request(reader, writer, {'op': 'lookup', 'users': [new_id]})
+        self.assertEqual(lookup['assignments'], response['assignments'])
+
+        response = await self.request(reader, writer, {'op': 'leave', 'users': served[:2]})
+        self.assertEqual(response['removed'], sorted(served[:2]))
+        response = await self.request(reader, writer, {'op': 'lookup', 'users': served[:2]})
+        self.assertEqual(response['assignments'], [None, None])
+
+        moved = self.satellite_coords[3] * 1.001
+        response = await self.request(reader, writer, {'op': 'satellites', 'ids': [3], 'coords': [moved.tolist()]})
+        self.assertEqual(response['moved'], [3])
+
+        self.assertIn('error', await self.request(reader, writer, {'op': 'teleport'}))
+        self.assertIn('error', await self.request(reader, writer, {'op': 'leave', 'users': [-1]}))
+        writer.write(b'not json\n')
+        self.assertIn('error', json.loads(await reader.readline()))
+        writer.close()
+
+        # every served user is still visible to its satellite and served once
+        user_satellite = self.server.published[0]
+        for user_id in np.flatnonzero(user_satellite >= 0).tolist():
+            self.assertIn(user_id, self.manager.satellites[user_satellite[user_id]].visible_users)
+
+    async def test_changes_are_coalesced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            await self.server.start(path=os.path.join(directory, 'server.sock'))
+            connections = [await asyncio.open_unix_connection(os.path.join(directory, 'server.sock')) for _ in range(5)]
+            coords = np.array(generateTestUsers(4, 1.0)) * 1.0
+            responses = await asyncio.gather(*[
+                self.request(reader, writer, {'op': 'join', 'coords': coords[i:i + 1].tolist()})
+                for i, (reader, writer) in enumerate(connections)
+            ])
+            self.assertEqual(self.server.batches, 1)
+            self.assertEqual(sorted(response['users'][0] for response in responses), list(range(1600, 1605)))
+            for _, writer in connections:
+                writer.close()
+
+    async def test_mapped_inputs(self):
+        # coordinates memory-mapped read-only from .npy files, as server.main loads them
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ['users.npy', 'satellites.npy']]
+            np.save(paths[0], np.array(generateTestUsers(40, 1)))
+            np.save(paths[1], self.satellite_coords)
+            user_coords, satellite_coords = loadCoordinates(paths[0]), loadCoordinates(paths[1])
+            self.assertFalse(satellite_coords.flags.writeable)
+            manager = StarlinkManager(user_coords, satellite_coords, seed=0)
+            manager.run()
+            self.server = AssignmentServer(manager, window=0.05)
+            await self.server.start()
+            reader, writer = await asyncio.open_connection(*self.server.address[:2])
+
+            moved = self.satellite_coords[3] * 1.001
+            response = await self.request(reader, writer, {'op': 'satellites', 'ids': [3], 'coords': [moved.tolist()]})
+            self.assertEqual(response['moved'], [3])
+            self.assertEqual(manager.satellite_coords[3].tolist(), moved.tolist())
+            self.assertEqual(satellite_coords[3].tolist(), self.satellite_coords[3].tolist())
+            writer.close()
+
+    async def test_empty_start(self):
+        # no users until the first join, as loadCoordinates gives for an empty file
+        manager = StarlinkManager(np.empty((0, 3)), self.satellite_coords, seed=0)
+        self.assertEqual(manager.run(), [])
+        self.server = AssignmentServer(manager, window=0.05)
+        await self.server.start()
+        reader, writer = await asyncio.open_connection(*self.server.address[:2])
+
+        coords = self.satellite_coords[:5] / np.linalg.norm(self.satellite_coords[:5], axis=1, keepdims=True)
+        response = await self.request(reader, writer, {'op': 'join', 'coords': coords.tolist()})
+        self.assertEqual(response['users'], list(range(5)))
+        # each is right under a satellite, so each is served by one that sees it
+        for user_id, (satellite_id, _) in enumerate(response['assignments']):
+            self.assertIn(user_id, manager.satellites[satellite_id].visible_users)
+        lookup = await self.request(reader, writer, {'op': 'lookup', 'users': [0, 5]})
+        self.assertEqual(lookup['assignments'], [response['assignments'][0], None])
+        writer.close()
+
+    async def test_failed_batch(self):
+        # the changes of a batch whose solve fails are applied and reported, each with its own id
+        await self.server.start()
+        connections = [await asyncio.open_connection(*self.server.address[:2]) for _ in range(3)]
+        served = [user_id for _, user_id in self.manager.generateResult()][:2]
+
+        def fail(*args, **options):
+            raise RuntimeError("solver crashed")
+        self.manager.resolve = fail
+        coords = self.satellite_coords[0] / np.linalg.norm(self.satellite_coords[0])
+        requests = [{'op': 'leave', 'users': served, 'id': 'first'}, {'op': 'join', 'coords': [coords.tolist()]}, {'op': 'leave', 'users': [-1]}]
+        responses = await asyncio.gather(*[self.request(reader, writer, request) for (reader, writer), request in zip(connections, requests)])
+        self.assertEqual(self.server.batches, 1)
+        self.assertEqual(responses[0], {'removed': sorted(served), 'solve_error': 'solver crashed', 'id': 'first'})
+        self.assertEqual(responses[1], {'users': [1600], 'assignments': [None], 'solve_error': 'solver crashed'})
+        self.assertEqual(responses[2], {'error': 'unknown user id'})
+
+        # lookups see the leave and the join, not the assignment before the batch
+        reader, writer = connections[0]
+        response = await self.request(reader, writer, {'op': 'lookup', 'users': served + [1600]})
+        self.assertEqual(response['assignments'], [None, None, None])
+        self.assertEqual(len(self.server.published[0]), 1601)
+
+        # a batch that fails outside the solve still gets one error per request
+        self.manager.addUsers = fail
+        response = await self.request(reader, writer, {'op': 'join', 'coords': [coords.tolist()], 'id': 2})
+        self.assertEqual(response, {'error': 'batch failed: solver crashed', 'id': 2})
+        for _, writer in connections:
+            writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,5 @@
 import random
 import math
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 
 def generateTestUsers(n, r):
     # generate n evenly-spaced angles
@@ -25,7 +23,15 @@ def generateTestSatellites(m, a, b):
     satellite_coords = [(r*math.sin(incl)*math.cos(ang), r*math.sin(incl)*math.sin(ang), r*math.cos(incl)) for r, incl, ang in zip(radii, inclinations, angles)]
     return satellite_coords
 
+def generateTestScenario(n=100, m=40, seed=0):
+    # an n * n user grid under m satellites, repeatable: both generators draw from the global random
+    random.seed(seed)
+    return generateTestUsers(n, 1), generateTestSatellites(m, 1.08, 1.09)
+
 def visualize_points(points):
+    # matplotlib is only needed for plotting, not for generating scenarios
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     ax.scatter([p[0] for p in points], [p[1] for p in points], [p[2] for p in points])
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from bulk_io import writeAssignments
+from satellite import SATELLITE_ANGLE_COSINE, StarlinkManager
+from verify import *
+from verify import main
+from test_utils import generateTestUsers, generateTestSatellites
+
+class TestVerify(unittest.TestCase):
+    def test_valid_solution(self):
+        manager = StarlinkManager(generateTestUsers(300, 1), generateTestSatellites(20, 1.08, 1.09), seed=1)
+        manager.run()
+        report = verifyManager(manager)
+        self.assertTrue(report['valid'], report['violations'])
+        self.assertEqual(report['served_users'], np.count_nonzero(manager.user_satellite >= 0))
+        self.assertEqual(sum(report['color_beams'].values()), report['beams'])
+        self.assertLessEqual(report['served_users'], report['coverable_users'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ['users.npy', 'satellites.npy', 'result.csv']]
+            np.save(paths[0], manager.user_coords)
+            np.save(paths[1], manager.satellite_coords)
+            writeAssignments(paths[2], manager.user_satellite, manager.user_color)
+            self.assertEqual(main(paths), 0)
+
+    def test_violations(self):
+        # one satellite overhead; users 0 and 1 nearly coincide, user 2 is on the far side
+        angles = np.linspace(0, 0.05, 40)
+        user_coords = np.stack([np.sin(angles), np.zeros(40), np.cos(angles)], axis=1)
+        user_coords[1] = [0, 1e-4, 1]
+        user_coords[2] = [0, 0, -1]
+        satellite_coords = np.array([[0, 0, 1.08], [0, 0, -1.08]])
+        assignments = [[0, 0, 0], [0, 1, 0], [0, 2, 1]] + [[0, user, user % 4] for user in range(3, 36)]
+        report = verifySolution(user_coords, satellite_coords, assignments + [[0, 0, 2], [5, 3, 0], [1, 2, 7]])
+        counts = {check: violation['count'] for check, violation in report['violations'].items()}
+        self.assertFalse(report['valid'])
+        self.assertEqual(counts['unknown_ids'], 1)
+        self.assertEqual(counts['unknown_colors'], 1)
+        self.assertEqual(counts['duplicate_users'], 1)
+        self.assertEqual(counts['over_capacity'], 37)
+        self.assertEqual(counts['outside_cone'], 1)
+        self.assertIn([[0, 0, 0], [0, 1, 0]], report['violations']['color_conflicts']['examples'])
+        self.assertEqual(report['full_satellites'], 1)
+
+        # without colors only the geometric checks run
+        report = verifySolution(user_coords, satellite_coords, [[0, 0], [0, 1], [1, 2]])
+        self.assertFalse(report['color_checked'])
+        self.assertNotIn('color_conflicts', report['violations'])
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['coverage'], 3 / 40)
+
+    def test_overloaded_satellite(self):
+        # thousands of rows on one satellite are checked one color at a time, not padded into every satellite
+        manager = StarlinkManager(generateTestUsers(100, 1), generateTestSatellites(50, 1.08, 1.09), seed=2)
+        manager.run()
+        users = np.flatnonzero(manager.user_satellite >= 0)
+        assignments = np.stack([manager.user_satellite[users], users, manager.user_color[users]], axis=1)
+        extra = np.arange(6000)
+        overloaded = np.concatenate([assignments, np.stack([np.zeros(6000, dtype=np.int64), extra, extra % 4], axis=1)])
+        report = verifySolution(manager.user_coords, manager.satellite_coords, overloaded)
+        self.assertEqual(report['violations']['over_capacity']['count'], np.count_nonzero(overloaded[:, 0] == 0))
+
+        # the same count as a full Gram matrix of satellite 0
+        rows = overloaded[overloaded[:, 0] == 0]
+        directions = manager.user_coords[rows[:, 1]] - manager.satellite_coords[0]
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        near = (directions @ directions.T > SATELLITE_ANGLE_COSINE) & (rows[:, 2, None] == rows[None, :, 2])
+        self.assertEqual(report['violations']['color_conflicts']['count'], np.count_nonzero(np.triu(near, 1)))
+        self.assertGreater(report['violations']['color_conflicts']['count'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import argparse
+import json
+import sys
+import numpy as np
+from bulk_io import loadCoordinates, readAssignments
+from satellite import MAX_BEAMS, SATELLITE_ANGLE_COSINE, Colors, withinUserCone
+
+# offending entries listed per check in the report
+MAX_EXAMPLES = 10
+
+def verifySolution(user_coords, satellite_coords, assignments, colors=None, visibility=None):
+    # checks (satellite, user) or (satellite, user, color) rows, like those of generateResult or
+    # bulk_io.writeAssignments, against the beam placement rules; colors may also be passed
+    # separately, and without any the color rule is skipped. Given the (indptr, indices)
+    # visibility, the report also counts the users that could have been served
+    user_coords = np.asarray(user_coords, dtype=np.float64).reshape(-1, 3)
+    satellite_coords = np.asarray(satellite_coords, dtype=np.float64).reshape(-1, 3)
+    assignments = np.asarray(assignments, dtype=np.int64)
+    assignments = assignments.reshape(-1, assignments.shape[-1] if assignments.ndim == 2 else 2)
+    if colors is None and assignments.shape[1] >= 3:
+        colors = assignments[:, 2]
+    satellites, users = assignments[:, 0], assignments[:, 1]
+    violations = {}
+
+    def record(check, rows):
+        violations[check] = {'count': int(len(rows)), 'examples': assignments[rows[:MAX_EXAMPLES]].tolist()}
+
+    # ids in range, the remaining checks only look at rows that pass
+    known = (satellites >= 0) & (satellites < len(satellite_coords)) & (users >= 0) & (users < len(user_coords))
+    record('unknown_ids', np.flatnonzero(~known))
+    if colors is not None:
+        colors = np.asarray(colors, dtype=np.int64)
+        record('unknown_colors', np.flatnonzero(known & ((colors < 0) | (colors >= len(Colors)))))
+        known &= (colors >= 0) & (colors < len(Colors))
+    rows = np.flatnonzero(known)
+    satellites, users = satellites[rows], users[rows]
+
+    # every user has at most one beam
+    order = np.argsort(users, kind='stable')
+    repeated = np.zeros(len(rows), dtype=bool)
+    repeated[order[1:]] = users[order[1:]] == users[order[:-1]]
+    record('duplicate_users', rows[repeated])
+
+    # every satellite has at most MAX_BEAMS beams
+    beams = np.bincount(satellites, minlength=len(satellite_coords))
+    record('over_capacity', rows[beams[satellites] > MAX_BEAMS])
+
+    # every link is within USER_ANGLE_DEGREES of the user's zenith
+    record('outside_cone', rows[~withinUserCone(user_coords[users], satellite_coords[satellites])])
+
+    # no two beams of one satellite and color within SATELLITE_ANGLE_DEGREES: a batched Gram
+    # matrix per satellite with its beams padded to the largest beam count, one pair per hit
+    if colors is not None and len(rows):
+        beam_colors = colors[rows]
+        order = np.lexsort((beam_colors, satellites))
+        starts = np.cumsum(beams) - beams
+        directions = user_coords[users[order]] - satellite_coords[satellites[order]]
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        conflicts = {'count': 0, 'examples': []}
+
+        def collect(first, second):
+            # pairs as positions in order, only the first few are kept as examples
+            conflicts['count'] += len(first)
+            missing = MAX_EXAMPLES - len(conflicts['examples'])
+            if missing > 0:
+                pairs = rows[order[np.stack([first[:missing], second[:missing]], axis=1)]]
+                conflicts['examples'] += [assignments[pair].tolist() for pair in pairs]
+
+        # satellites within capacity, padded to at most MAX_BEAMS
+        fits = np.flatnonzero(beams[satellites[order]] <= MAX_BEAMS)
+        if len(fits):
+            fitting = satellites[order[fits]]
+            width = int(beams[fitting].max())
+            slots = fits - starts[fitting]
+            padded = np.zeros((len(satellite_coords), width, 3))
+            padded_colors = np.full((len(satellite_coords), width), -1)
+            padded[fitting, slots] = directions[fits]
+            padded_colors[fitting, slots] = beam_colors[order[fits]]
+            upper = np.triu(np.ones((width, width), dtype=bool), 1)
+            # blocks of satellites keep the Gram matrices to a few million entries
+            step = max(1, (1 << 22) // (width * width))
+            for block in range(0, len(satellite_coords), step):
+                near = padded[block:block + step] @ padded[block:block + step].transpose(0, 2, 1) > SATELLITE_ANGLE_COSINE
+                block_colors = padded_colors[block:block + step]
+                near &= (block_colors[:, :, None] == block_colors[:, None, :]) & (block_colors[:, :, None] >= 0) & upper
+                satellite_ids, first, second = np.nonzero(near)
+                satellite_ids += block
+                collect(starts[satellite_ids] + first, starts[satellite_ids] + second)
+
+        # over-capacity satellites, which a bad output can load with any number of beams: one
+        # color of one satellite at a time, in chunks of rows of a few million Gram entries
+        for satellite_id in np.flatnonzero(beams > MAX_BEAMS).tolist():
+            begin = starts[satellite_id]
+            satellite_colors = beam_colors[order[begin:begin + beams[satellite_id]]]
+            bounds = np.concatenate([[0], np.flatnonzero(np.diff(satellite_colors)) + 1, [len(satellite_colors)]]) + begin
+            for group_start, group_end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                group = directions[group_start:group_end]
+                chunk = max(1, (1 << 22) // len(group))
+                for offset in range(0, len(group), chunk):
+                    first, second = np.nonzero(group[offset:offset + chunk] @ group.T > SATELLITE_ANGLE_COSINE)
+                    first += offset
+                    keep = second > first
+                    collect(group_start + first[keep], group_start + second[keep])
+        violations['color_conflicts'] = conflicts
+
+    served = np.unique(users)
+    report = {
+        'valid': all(v['count'] == 0 for v in violations.values()),
+        'violations': violations,
+        'color_checked': colors is not None,
+        'total_users': int(len(user_coords)),
+        'served_users': int(len(served)),
+        'coverage': len(served) / len(user_coords) if len(user_coords) else 0.0,
+        'beams': int(len(rows)),
+        'satellites': int(len(satellite_coords)),
+        'full_satellites': int(np.count_nonzero(beams >= MAX_BEAMS)),
+        'empty_satellites': int(np.count_nonzero(beams == 0)),
+        'mean_beams': float(beams.mean()) if len(beams) else 0.0,
+    }
+    if colors is not None:
+        report['color_beams'] = {color.name: int(count) for color, count in zip(Colors, np.bincount(colors[rows], minlength=len(Colors)))}
+    if visibility is not None:
+        coverable = int(np.count_nonzero(np.bincount(np.asarray(visibility[1]), minlength=len(user_coords))))
+        report['coverable_users'] = coverable
+        report['coverable_coverage'] = len(served) / coverable if coverable else 0.0
+    return report
+
+def verifyManager(manager):
+    # verifies the current assignment of a StarlinkManager, colors included
+    users = np.flatnonzero(manager.user_satellite >= 0)
+    assignments = np.stack([manager.user_satellite[users], users, manager.user_color[users]], axis=1)
+    return verifySolution(manager.user_coords, manager.satellite_coords, assignments, visibility=manager.visibility())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check beam assignments against the placement rules and report coverage.')
+    parser.add_argument('users', help='user coordinates, in any format bulk_io reads')
+    parser.add_argument('satellites', help='satellite coordinates')
+    parser.add_argument('assignments', help='satellite,user[,color] rows as written by cli.py')
+    args = parser.parse_args(argv)
+
+    report = verifySolution(loadCoordinates(args.users), loadCoordinates(args.satellites), readAssignments(args.assignments))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0 if report['valid'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())